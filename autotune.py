@@ -0,0 +1,153 @@
+"""
+Find the thread count, batch size and model_image_size that fit a latency target on this host.
+
+    python autotune.py --target_ms 250 --path busesTest
+    python autotune.py --target_ms 100 --random --sizes 320 416
+
+Every thread setting runs in a fresh process (a keras session cannot change its thread pools),
+pinned to as many cores as it has threads. A setting meets the target when its p95 batch
+latency is below target_ms. Among those the largest input size (then the highest throughput)
+wins, or with --prefer throughput the most images per second on the whole host, counting one
+pinned worker per slice of cores.
+"""
+import argparse
+import multiprocessing
+import shutil
+import tempfile
+from queue import Empty
+from timeit import default_timer as timer
+
+import numpy as np
+
+from yolo3.session import available_cpus
+from yolo3.sources import ImageSource
+
+
+def _trial(threads, inter_threads, cpu_affinity, yolo_args, sizes, batch_sizes, image_paths, repeat, results):
+    '''Process entry: time every (size, batch size) with one thread setting, put the rows on results'''
+    from PIL import Image
+    from yolo import YOLO
+    from yolo3.session import configure_session
+    from benchmark import random_yolo, synthetic_image
+
+    configure_session(threads, inter_threads, cpu_affinity)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        yolo = YOLO(**yolo_args) if yolo_args else random_yolo(tmp_dir)
+        if image_paths:
+            images = [Image.open(path) for path in image_paths]
+            for image in images:
+                image.load()
+        else:
+            images = [synthetic_image((1920, 1080), seed) for seed in range(8)]
+
+        rows = []
+        for size in sizes:
+            yolo.model_image_size = (size, size)
+            for batch_size in batch_sizes:
+                batches = [[images[(i * batch_size + b) % len(images)] for b in range(batch_size)]
+                           for i in range(repeat + 1)]
+                times = []
+                for batch in batches:
+                    start = timer()
+                    if batch_size == 1:
+                        yolo.detect_image(batch[0])
+                    else:
+                        yolo.detect_images(batch, batch_size=batch_size)
+                    times.append(timer() - start)
+                times = 1e3 * np.array(times[1:])  # the first batch builds the graph
+                rows.append({'threads': threads, 'inter_threads': inter_threads, 'size': size,
+                             'batch_size': batch_size, 'p50_ms': float(np.percentile(times, 50)),
+                             'p95_ms': float(np.percentile(times, 95)),
+                             'images_per_s': float(1e3 * batch_size / times.mean())})
+        results.put(rows)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Autotune threads, batch size and input size for a latency target.')
+    parser.add_argument('--target_ms', type=float, required=True, help='p95 latency budget of one detection call')
+    parser.add_argument('--path', help='directory of sample images, default synthetic 1920x1080 images')
+    parser.add_argument('--samples', type=int, default=16, help='sample images read from --path')
+    parser.add_argument('--random', action='store_true', help='random weights instead of --model')
+    parser.add_argument('--model', dest='model_path', default='final_single_cust_loss4_anchs.h5')
+    parser.add_argument('--anchors', dest='anchors_path', default='bus_anchors.txt')
+    parser.add_argument('--classes', dest='classes_path', default='bus_classes_single.txt')
+    parser.add_argument('--threads', type=int, nargs='+', help='intra-op threads, default powers of 2 up to the cores')
+    parser.add_argument('--inter_threads', type=int, nargs='+', default=[1])
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[320, 416, 512, 608], help='square model_image_size')
+    parser.add_argument('--repeat', type=int, default=10, help='timed calls per setting')
+    parser.add_argument('--prefer', choices=['size', 'throughput'], default='size')
+    args = parser.parse_args()
+
+    cpus = available_cpus()
+    threads = args.threads or sorted(set([2**i for i in range(len(cpus).bit_length()) if 2**i <= len(cpus)]
+                                         + [len(cpus)]))
+    yolo_args = None if args.random else {'model_path': args.model_path, 'anchors_path': args.anchors_path,
+                                          'classes_path': args.classes_path}
+    image_paths = None
+    if args.path:
+        source = ImageSource(args.path)
+        image_paths = [source.path(name) for name, _ in zip(source, range(args.samples))]
+
+    # spawn: tensorflow state does not survive a fork.
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    rows = []
+    for n in threads:
+        for inter_threads in args.inter_threads:
+            print('timing {} intra-op, {} inter-op threads'.format(n, inter_threads))
+            p = ctx.Process(target=_trial, args=(n, inter_threads, cpus[:n], yolo_args, args.sizes, args.batch,
+                                                 image_paths, args.repeat, results))
+            p.start()
+            while True:
+                try:
+                    trial_rows = results.get(timeout=1.)
+                    break
+                except Empty:
+                    if not p.is_alive():
+                        # The rows may have arrived between the timeout and the exit.
+                        try:
+                            trial_rows = results.get_nowait()
+                            break
+                        except Empty:
+                            pass
+                        print('trial with {} threads failed (exit code {})'.format(n, p.exitcode))
+                        trial_rows = []
+                        break
+            p.join()
+            for row in trial_rows:
+                # One pinned worker per slice of n cores.
+                row['workers'] = max(1, len(cpus) // n)
+                row['host_images_per_s'] = row['workers'] * row['images_per_s']
+            rows.extend(trial_rows)
+
+    if not rows:
+        return
+    header = '{:>7} {:>5} {:>5} {:>5} {:>8} {:>8} {:>7} {:>7} {:>9}'
+    print(header.format('threads', 'inter', 'size', 'batch', 'p50 ms', 'p95 ms', 'img/s', 'workers', 'host img/s'))
+    for row in rows:
+        print('{:>7} {:>5} {:>5} {:>5} {:>8.1f} {:>8.1f} {:>7.2f} {:>7} {:>9.2f}{}'.format(
+            row['threads'], row['inter_threads'], row['size'], row['batch_size'], row['p50_ms'], row['p95_ms'],
+            row['images_per_s'], row['workers'], row['host_images_per_s'],
+            '' if row['p95_ms'] <= args.target_ms else '  over target'))
+
+    within = [row for row in rows if row['p95_ms'] <= args.target_ms]
+    if not within:
+        best = min(rows, key=lambda row: row['p95_ms'])
+        print('no setting meets {} ms, the fastest is {:.1f} ms p95'.format(args.target_ms, best['p95_ms']))
+    elif args.prefer == 'size':
+        best = max(within, key=lambda row: (row['size'], row['host_images_per_s']))
+    else:
+        best = max(within, key=lambda row: (row['host_images_per_s'], row['size']))
+    print('best: model_image_size ({0[size]}, {0[size]}), batch {0[batch_size]}, {0[threads]} intra-op and '
+          '{0[inter_threads]} inter-op threads, {0[p95_ms]:.1f} ms p95'.format(best))
+    workers = ' -w {} --pin'.format(best['workers']) if best['workers'] > 1 else ''
+    print('  yolo_video.py --size {0[size]} -b {0[batch_size]}{1} --threads {0[threads]} '
+          '--inter_threads {0[inter_threads]}'.format(best, workers))
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,210 @@
+"""
+Offline benchmark of the inference path, on random weights and synthetic images.
+
+    python benchmark.py run --out bench.json
+    python benchmark.py compare baseline.json bench.json --tolerance 0.15
+
+run builds yolo_body / tiny_yolo_body and the resnet50 post classifier with seeded random
+weights (nothing to download) and times letterbox, detect_image, the NMS implementations,
+predict_class and preprocess_true_boxes. compare exits 1 when a stage got slower than the
+baseline by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from nms_benchmark import random_boxes, time_call, run_benchmark
+
+IMAGE_SIZES = [(640, 480), (1920, 1080), (4000, 3000)]  # (w, h)
+BOX_DENSITIES = [1, 5, 20]
+NMS_SIZES = [50, 200, 1000]
+
+
+def synthetic_image(size, seed=0):
+    '''Noise image of size (w, h), noise is the worst case for resampling and JPEG alike'''
+    w, h = size
+    return Image.fromarray(np.random.RandomState(seed).randint(0, 256, (h, w, 3), dtype='uint8'))
+
+
+def image_boxes(size, num_boxes, seed=0):
+    '''num_boxes bus sized boxes (y_min, x_min, y_max, x_max) inside an image of size (w, h)'''
+    w, h = size
+    boxes, _, _ = random_boxes(num_boxes, image_size=(h, w), num_objects=num_boxes, seed=seed)
+    return np.clip(boxes, 0, [h - 1, w - 1, h, w]).astype('int')
+
+
+def random_yolo(tmp_dir, tiny=False, num_classes=1, seed=0):
+    '''YOLO on a yolo_body (tiny_yolo_body) saved with seeded random weights in tmp_dir'''
+    import tensorflow as tf
+    from keras.layers import Input
+    from yolo import YOLO
+    from yolo3.model import yolo_body, tiny_yolo_body
+
+    np.random.seed(seed)
+    tf.set_random_seed(seed)
+    num_anchors = 6 if tiny else 9
+    body = tiny_yolo_body if tiny else yolo_body
+    model = body(Input(shape=(None, None, 3)), 3, num_classes)  # 3 anchors per output scale
+    name = 'tiny' if tiny else 'full'
+    model_path = os.path.join(tmp_dir, name + '.h5')
+    model.save(model_path, include_optimizer=False)
+    anchors_path = os.path.join(tmp_dir, name + '_anchors.txt')
+    with open(anchors_path, 'w') as f:
+        f.write(','.join(str(x) for x in np.random.RandomState(seed).randint(10, 400, 2 * num_anchors)))
+    classes_path = os.path.join(tmp_dir, 'classes.txt')
+    with open(classes_path, 'w') as f:
+        f.write('\n'.join('class{}'.format(c) for c in range(num_classes)))
+    return YOLO(model_path=model_path, anchors_path=anchors_path, classes_path=classes_path)
+
+
+def bench_letterbox(results, repeat):
+    from yolo3.utils import Letterboxer
+    letterbox = Letterboxer((416, 416))
+    for size in IMAGE_SIZES:
+        image = synthetic_image(size)
+        letterbox(image)
+        results['letterbox/{}x{}'.format(*size)] = time_call(lambda: letterbox(image), repeat)
+
+
+def bench_detect_image(results, repeat, tmp_dir, models):
+    for name in models:
+        yolo = random_yolo(tmp_dir, tiny=name == 'tiny')
+        for size in IMAGE_SIZES:
+            image = synthetic_image(size)
+            yolo.detect_image(image)  # graph setup
+            results['detect_image/{}/{}x{}'.format(name, *size)] = time_call(lambda: yolo.detect_image(image), repeat)
+
+
+def bench_nms(results, repeat):
+    for num_boxes, name, ms in run_benchmark(NMS_SIZES, repeat):
+        results['nms/{}/{}'.format(name, num_boxes)] = ms
+
+
+def bench_predict_class(results, repeat):
+    from classification_train import get_resnet50, predict_class
+    np.random.seed(0)
+    classifier = {'resnet50': get_resnet50(num_classes=6, w=None)}
+    size = (1920, 1080)
+    image = synthetic_image(size)
+    for num_boxes in BOX_DENSITIES:
+        boxes = image_boxes(size, num_boxes)
+        predict_class(image, boxes, classifier)
+        results['predict_class/{}'.format(num_boxes)] = time_call(
+            lambda: predict_class(image, boxes, classifier), repeat)
+
+
+def bench_preprocess_true_boxes(results, repeat, batch_size=8, max_boxes=20):
+    from yolo3.model import preprocess_true_boxes
+    anchors = np.random.RandomState(0).randint(10, 400, (9, 2)).astype('float32')
+    for num_boxes in BOX_DENSITIES:
+        true_boxes = np.zeros((batch_size, max_boxes, 5), dtype='float32')
+        for b in range(batch_size):
+            y_min, x_min, y_max, x_max = image_boxes((416, 416), num_boxes, seed=b).T
+            true_boxes[b, :num_boxes] = np.stack([x_min, y_min, x_max, y_max, np.zeros(num_boxes)], axis=1)
+        results['preprocess_true_boxes/{}'.format(num_boxes)] = time_call(
+            lambda: preprocess_true_boxes(true_boxes, (416, 416), anchors, 6), repeat)
+
+
+STAGES = ['letterbox', 'detect_image', 'nms', 'predict_class', 'preprocess_true_boxes']
+
+
+def run(stages, models, repeat, threads=None):
+    '''Return {stage/case: median ms}'''
+    from yolo3.session import configure_session
+    if threads:
+        configure_session(threads, 1)
+    results = {}
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for stage in stages:
+            print('benchmarking {}'.format(stage))
+            if stage == 'letterbox':
+                bench_letterbox(results, repeat)
+            elif stage == 'detect_image':
+                bench_detect_image(results, repeat, tmp_dir, models)
+            elif stage == 'nms':
+                bench_nms(results, repeat)
+            elif stage == 'predict_class':
+                bench_predict_class(results, repeat)
+            elif stage == 'preprocess_true_boxes':
+                bench_preprocess_true_boxes(results, repeat)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return results
+
+
+def environment():
+    import keras
+    import tensorflow as tf
+    return {'platform': platform.platform(), 'processor': platform.processor(), 'cpus': os.cpu_count(),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'tensorflow': tf.__version__, 'keras': keras.__version__}
+
+
+def compare(baseline, current, tolerance):
+    '''Print the median ms of every case in both runs, return the cases slower by more than tolerance'''
+    regressions = []
+    print('{:<40} {:>10} {:>10} {:>8}'.format('case', 'base ms', 'ms', 'ratio'))
+    for case in sorted(set(baseline) | set(current)):
+        if case not in baseline or case not in current:
+            print('{:<40} {:>10} {:>10}'.format(case, *('{:.3f}'.format(results[case]) if case in results else '-'
+                                                      for results in (baseline, current))))
+            continue
+        ratio = current[case] / max(baseline[case], 1e-9)
+        flag = ''
+        if ratio > 1. + tolerance:
+            flag = 'REGRESSION'
+            regressions.append(case)
+        elif ratio < 1. - tolerance:
+            flag = 'faster'
+        print('{:<40} {:>10.3f} {:>10.3f} {:>8.2f} {}'.format(case, baseline[case], current[case], ratio, flag))
+    return regressions
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Offline inference benchmark on random weights.')
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='run the benchmark and write the results as JSON')
+    run_parser.add_argument('--out', required=True)
+    run_parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    run_parser.add_argument('--models', nargs='+', choices=['full', 'tiny'], default=['full', 'tiny'],
+                            help='detect_image models')
+    run_parser.add_argument('--repeat', type=int, default=10)
+    run_parser.add_argument('--threads', type=int, help='tensorflow intra-op threads, default all cores')
+    compare_parser = subparsers.add_parser('compare', help='flag regressions against a baseline run')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--tolerance', type=float, default=0.15,
+                                help='relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run(args.stages, args.models, args.repeat, args.threads)
+        with open(args.out, 'w') as f:
+            json.dump({'environment': environment(), 'repeat': args.repeat, 'threads': args.threads,
+                       'results': results}, f, indent=2, sort_keys=True)
+        print('{} cases written to {}'.format(len(results), args.out))
+    elif args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        if baseline['environment'] != current['environment']:
+            print('warning: the runs come from different environments')
+        regressions = compare(baseline['results'], current['results'], args.tolerance)
+        if regressions:
+            print('{} regressions: {}'.format(len(regressions), ', '.join(regressions)))
+            sys.exit(1)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    _main()
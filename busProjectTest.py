@@ -6,18 +6,30 @@ import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 import numpy as np
 import ast
+from PIL import Image
 
 fontdict = {'fontsize':15, 'weight':'bold'}
-plt.switch_backend('Qt5Agg')
+try:
+    plt.switch_backend('Qt5Agg')
+except ImportError:
+    # Headless use, e.g. evaluate() from replay_predictions.py
+    pass
 
 class IMAGE:
 
     def __init__(self):
         self.ROIS = []
 
-    def set_image(self, im):
-        self.I = nd.imread(im)
-        self.imShape = self.I.shape
+    def set_image(self, im, draftSize = None):
+        # draftSize (w, h) : decode JPEGs at a reduced resolution, ROIs stay in original pixels
+        if(draftSize is None):
+            self.I = nd.imread(im)
+            self.imShape = self.I.shape
+        else:
+            pil = Image.open(im)
+            self.imShape = (pil.size[1], pil.size[0], len(pil.getbands()))
+            pil.draft('RGB', draftSize)
+            self.I = np.asarray(pil)
 
     def clear_ROIS(self):
         self.ROIS = []
@@ -27,7 +39,8 @@ class IMAGE:
 
     def show_ROI(self, title, edgecolor, numGT, text, saveDir = None):
         fig, ax = plt.subplots(1)
-        ax.imshow(self.I)
+        # extent keeps the axes in original pixels when the image was decoded smaller
+        ax.imshow(self.I, extent = (0, self.imShape[1], self.imShape[0], 0))
         if(not isinstance(edgecolor,list) and len(self.ROIS) > 0):
             edgecolor = [edgecolor] * len(self.ROIS)
         for i in range(0,numGT):
@@ -92,7 +105,52 @@ def IOU(boxAList, boxBList):
                 fp -= 1
     return tp, fp, missed, iou
 
-def runTest(annFileNameGT, myAnnFileName, busDir , saveDir = None, elapsed = None):
+def parseAnns(line):
+    anns = line[line.index(':') + 1:].replace('\n', '')
+    anns = ast.literal_eval(anns)
+    if (not isinstance(anns, tuple)):
+        anns = [anns]
+    return anns
+
+def f1Score(TP, FP, MISS):
+    if(TP == 0):
+        return 0
+    precision = TP/(TP + FP)
+    recall = TP/(TP + MISS)
+    return 2*(precision * recall)/(precision + recall)
+
+def evaluate(gtLines, estLines, ignoreColor = False):
+    """
+    runTest scores without reading or drawing any image, returns TP, FP, MISS, F1
+    ignoreColor - match boxes by IOU only
+    """
+    estByName = {}
+    for x in estLines:
+        estByName.setdefault(x.split(':')[0], x)
+    TP = 0
+    FP = 0
+    MISS = 0
+    for lineGT in gtLines:
+        lineGT = lineGT.replace(' ','')
+        imName = lineGT.split(':')[0]
+        lineE = estByName.get(imName, imName + ':')
+        annsGT = parseAnns(lineGT)
+        if('[' in lineE):
+            annsE = parseAnns(lineE)
+            if(ignoreColor):
+                annsGT = [list(ann[:4]) + [0] for ann in annsGT]
+                annsE = [list(ann[:4]) + [0] for ann in annsE]
+            tp, fp, missed, iou = IOU(annsGT, annsE)
+        else:
+            tp = 0
+            fp = 0
+            missed = len(annsGT)
+        TP += tp
+        FP += fp
+        MISS += missed
+    return TP, FP, MISS, f1Score(TP, FP, MISS)
+
+def runTest(annFileNameGT, myAnnFileName, busDir , saveDir = None, elapsed = None, draftSize = None):
 
     image = IMAGE()
     objectsColors = {'g':'1', 'y':'2', 'w':'3', 's':'4', 'b':'5', 'r':'6'}
@@ -120,7 +178,7 @@ def runTest(annFileNameGT, myAnnFileName, busDir , saveDir = None, elapsed = Non
         else:
             lineE = lineE[0]
         bus = os.path.join(busDir, imName)
-        image.set_image(bus)
+        image.set_image(bus, draftSize)
         image.clear_ROIS()
         annsGT = lineGT[lineGT.index(':') + 1:].replace('\n', '')
         annsE = lineE[lineE.index(':') + 1:].replace('\n', '')
@@ -155,12 +213,7 @@ def runTest(annFileNameGT, myAnnFileName, busDir , saveDir = None, elapsed = Non
         text = 'IOU Scores : ' + iouStr + '\nTP = {}, FP = {}, Missed = {} '.format(tp, fp, missed)
         image.show_ROI(edgecolor = colors, title = imName, numGT = numGT , text = text, saveDir = saveDir)
 
-    if(TP == 0):
-        F1Score = 0
-    else:
-        precision = TP/(TP + FP)
-        recall = TP/(TP + MISS)
-        F1Score = 2*(precision * recall)/(precision + recall)
+    F1Score = f1Score(TP, FP, MISS)
     strToWrite = 'Total detections = {}/{}\nTotal False Positives = {}\nTotal missed = {}'.format(TP, TP+MISS, FP, MISS)
     strToWrite += '\nF1 SCORE : {0:.3f}'.format(F1Score)
     if(not elapsed is None):
@@ -1,5 +1,7 @@
 import numpy as np
 import PIL
+import tensorflow as tf
+from keras import backend as K
 from keras.models import Model
 from keras.layers import Dense, GlobalAveragePooling2D, Dropout, Flatten, BatchNormalization, GlobalMaxPooling2D
 from keras.preprocessing.image import ImageDataGenerator
@@ -264,7 +266,12 @@ def predict_class(pil_image, boxes, classifier):
 
     x_img_arr = np.array(x_img_arr)
     preped = preprocess_input(x_img_arr)
-    y_preds = resnet50.predict(preped)
+    # Optional yolo3.profiling.TraceSampler, traces a sample of the classifier runs
+    trace_sampler = classifier.get('trace_sampler')
+    if trace_sampler is not None:
+        y_preds = trace_sampler.predict(resnet50, preped, 'classifier')
+    else:
+        y_preds = resnet50.predict(preped)
     # Transform probabilities to labels (svm is alrady labels)
     y_pred = np.argmax(y_preds, axis=1)
 
@@ -278,6 +285,48 @@ def predict_class(pil_image, boxes, classifier):
 # End
 
 
+def pil_crop_indices(start, end, size):
+    """
+    Source pixel of every output pixel of PIL crop((.., start, .., end, ..)).resize(.., NEAREST) along one axis
+    start, end : int32 tensors (n,), the crop is [start, end)
+    size : output pixels
+    returns int32 tensor (n, size), may fall outside the image where PIL pads the crop
+    """
+    # PIL (ImagingScaleAffine) walks the source by adding the float64 step to (step / 2),
+    # the floor of that running sum is its pixel. The same sum on CPU gives the same pixels.
+    step = K.cast(end - start, 'float64')[:, None] / size
+    offsets = tf.cumsum(K.concatenate([step / 2., K.tile(step, [1, size - 1])], axis=1), axis=1)
+    return start[:, None] + K.cast(tf.floor(offsets), 'int32')
+
+
+def crop_and_classify(image_tensor, boxes, classifier, net_type='resnet50'):
+    """
+    In-graph counterpart of predict_class, so the post classifier runs in the detection sess.run
+    image_tensor : float tensor (1, H, W, 3), original resolution RGB in [0, 255]
+    boxes : tensor (n, 4) of [top, left, bottom, right] i.e [y1, x1, y2, x2] in image pixels
+    returns the predicted class tensor (n,)
+    The crops are the ones predict_class and the training (process_lines) feed the classifier:
+    boxes truncated to integers like YOLO._finalize, PIL crop (end exclusive, black outside the
+    image) and the nearest neighbour resize that is the PIL default resample before Pillow 7.
+    With Pillow >= 7 predict_class resizes bicubic instead, compare F1 before mixing the two.
+    """
+    width, height = network_input_shape[net_type]
+    boxes = K.cast(boxes, 'int32')
+    image_hw = K.shape(image_tensor)[1:3]
+    rows = pil_crop_indices(boxes[:, 0], boxes[:, 2], height)
+    cols = pil_crop_indices(boxes[:, 1], boxes[:, 3], width)
+    inside = (K.cast((rows >= 0) & (rows < image_hw[0]), 'float32')[:, :, None] *
+              K.cast((cols >= 0) & (cols < image_hw[1]), 'float32')[:, None, :])
+    rows = tf.clip_by_value(rows, 0, image_hw[0] - 1)
+    cols = tf.clip_by_value(cols, 0, image_hw[1] - 1)
+    indices = K.stack([K.tile(rows[:, :, None], [1, 1, width]), K.tile(cols[:, None, :], [1, height, 1])], axis=-1)
+    crops = tf.gather_nd(image_tensor[0], indices) * inside[..., None]
+    # keras resnet50 preprocess_input : RGB -> BGR and ImageNet mean subtraction
+    crops = crops[..., ::-1] - K.constant([103.939, 116.779, 123.68])
+    y_preds = classifier(crops)
+    return K.argmax(y_preds, axis=-1)
+
+
 def main():
     print('unit testing')
     train_anns = '/home/tamirmal/workspace/git/tau_proj_prep/OUT_yolo_train_zero_based.txt'
@@ -0,0 +1,83 @@
+"""
+Accuracy / latency comparison of the keras and the int8 TFLite (convert_tflite.py) backends
+on annotated bus images, scored with the busProjectTest F1.
+
+    python compare_backends.py --anns annotationsTest.txt --buses busesTest \
+        --tflite yolo_int8.tflite --classifier_tflite resnet50_int8.tflite
+"""
+import argparse
+import os
+from timeit import default_timer as timer
+
+import numpy as np
+from PIL import Image
+
+from yolo import YOLO
+from yolo_video import load_classifier
+from classification_train import predict_class
+from yolo3.annotations import format_detections
+from busProjectTest import evaluate
+
+
+def run_backend(yolo, classifier, names, busDir):
+    '''Annotation lines and per image detect_image latencies (seconds, classification included)'''
+    lines, latencies = [], []
+    for name in names:
+        image = Image.open(os.path.join(busDir, name))
+        image.load()
+        start = timer()
+        _, boxes, scores, classes = yolo.detect_image(image, predict_class, {'resnet50': classifier})
+        latencies.append(timer() - start)
+        line = format_detections(name, boxes, classes, image.size, remap=True)
+        if line is not None:
+            lines.append(line)
+    return lines, latencies
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='F1 and latency of the keras and TFLite backends.')
+    parser.add_argument('--anns', required=True, help='ground truth annotations file')
+    parser.add_argument('--buses', required=True, help='directory of the annotated images')
+    parser.add_argument('--tflite', required=True, help='detector written by convert_tflite.py')
+    parser.add_argument('--classifier_tflite', help='classifier written by convert_tflite.py, '
+                        'default the keras classifier for both backends')
+    parser.add_argument('--model', dest='model_path', default='final_single_cust_loss4_anchs.h5')
+    parser.add_argument('--classifier', default='resnet50_best.h5')
+    parser.add_argument('--anchors', dest='anchors_path', default='bus_anchors.txt')
+    parser.add_argument('--classes', dest='classes_path', default='bus_classes_single.txt')
+    parser.add_argument('--limit', type=int, help='only the first LIMIT annotated images')
+    parser.add_argument('--ignore_color', action='store_true', help='match boxes by IOU only')
+    args = parser.parse_args()
+
+    with open(args.anns) as f:
+        gtLines = [line for line in f if ':' in line][:args.limit]
+    names = [line.replace(' ', '').split(':')[0] for line in gtLines]
+
+    yolo_args = {'anchors_path': args.anchors_path, 'classes_path': args.classes_path}
+    classifier = load_classifier(args.classifier)
+    backends = [
+        ('keras', YOLO(model_path=args.model_path, **yolo_args), classifier),
+        ('tflite', YOLO(model_path=args.tflite, backend='tflite', **yolo_args),
+         load_classifier(args.classifier_tflite) if args.classifier_tflite else classifier),
+    ]
+
+    results = []
+    for name, yolo, backend_classifier in backends:
+        # The first image pays for graph and interpreter setup, it is not timed.
+        run_backend(yolo, backend_classifier, names[:1], args.buses)
+        lines, latencies = run_backend(yolo, backend_classifier, names, args.buses)
+        TP, FP, MISS, F1 = evaluate(gtLines, lines, ignoreColor=args.ignore_color)
+        results.append((name, TP, FP, MISS, F1, 1e3 * np.array(latencies)))
+
+    print('{} images'.format(len(names)))
+    print('{:>8} {:>5} {:>5} {:>5} {:>7} {:>9} {:>9} {:>9}'.format(
+        'backend', 'TP', 'FP', 'MISS', 'F1', 'mean ms', 'p50 ms', 'p95 ms'))
+    for name, TP, FP, MISS, F1, ms in results:
+        print('{:>8} {:>5} {:>5} {:>5} {:>7.3f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+            name, TP, FP, MISS, F1, ms.mean(), np.percentile(ms, 50), np.percentile(ms, 95)))
+    (_, _, _, _, f1_keras, ms_keras), (_, _, _, _, f1_tflite, ms_tflite) = results
+    print('tflite: F1 {:+.3f}, mean latency x{:.2f}'.format(f1_tflite - f1_keras, ms_tflite.mean() / ms_keras.mean()))
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,93 @@
+"""
+Convert the YOLO detector or the resnet50 post classifier to TFLite with post-training int8
+quantization, calibrated on a sample of the annotated bus images.
+
+    python convert_tflite.py detector yolo_int8.tflite --anns annotationsTrain.txt --buses busesTrain
+    python convert_tflite.py classifier resnet50_int8.tflite --anns annotationsTrain.txt --buses busesTrain
+
+Use them with yolo_video.py --tflite yolo_int8.tflite --classifier resnet50_int8.tflite,
+compare_backends.py reports what the quantization costs in F1.
+"""
+import argparse
+import os
+import random
+
+import numpy as np
+from keras import backend as K
+from PIL import Image
+
+from yolo3.model import load_yolo_model
+from yolo3.tflite import convert_keras
+from yolo3.utils import Letterboxer
+from busProjectTest import parseAnns
+from train import get_classes, get_anchors
+
+
+def sample_annotations(anns_path, samples, seed=0):
+    '''(image name, ground truth boxes) of samples random annotation lines'''
+    with open(anns_path) as f:
+        lines = [line.replace(' ', '') for line in f if ':' in line]
+    random.Random(seed).shuffle(lines)
+    return [(line.split(':')[0], parseAnns(line)) for line in lines[:samples]]
+
+
+def detector_data(annotations, busDir, size):
+    '''Letterboxed images scaled to [0, 1], as YOLO feeds them'''
+    h, w = size
+    letterbox = Letterboxer((w, h))
+    def gen():
+        for name, _ in annotations:
+            image_data, _ = letterbox(Image.open(os.path.join(busDir, name)))
+            yield np.expand_dims(image_data, 0).astype('float32') / 255.
+    return gen
+
+
+def classifier_data(annotations, busDir, max_crops):
+    '''Ground truth bus crops prepared like classification_train.predict_class'''
+    from keras.applications.resnet50 import preprocess_input
+    def gen():
+        crops = 0
+        for name, anns in annotations:
+            image = Image.open(os.path.join(busDir, name)).convert('RGB')
+            for x, y, w, h in (ann[:4] for ann in anns):
+                crop = image.crop((x, y, x + w, y + h)).resize((224, 224))
+                yield preprocess_input(np.expand_dims(np.asarray(crop, dtype='float32'), 0))
+                crops += 1
+                if crops == max_crops:
+                    return
+    return gen
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='int8 TFLite conversion of the detector or the classifier.')
+    parser.add_argument('model', choices=['detector', 'classifier'])
+    parser.add_argument('output_path', help='path of the .tflite model')
+    parser.add_argument('--anns', required=True, help='annotations file of the calibration images')
+    parser.add_argument('--buses', required=True, help='directory of the calibration images')
+    parser.add_argument('--samples', type=int, default=100, help='calibration images (classifier: crops)')
+    parser.add_argument('--weights', help='detector .h5 (default final_single_cust_loss4_anchs.h5) '
+                        'or classifier weights (default resnet50_best.h5)')
+    parser.add_argument('--anchors', dest='anchors_path', default='bus_anchors.txt')
+    parser.add_argument('--classes', dest='classes_path', default='bus_classes_single.txt')
+    parser.add_argument('--size', type=int, nargs=2, default=[416, 416], help='detector input height and width')
+    args = parser.parse_args()
+
+    # Inference mode batch norms, before any model is built.
+    K.set_learning_phase(0)
+    annotations = sample_annotations(args.anns, args.samples)
+    if args.model == 'detector':
+        num_anchors = len(get_anchors(args.anchors_path))
+        num_classes = len(get_classes(args.classes_path))
+        model = load_yolo_model(args.weights or 'final_single_cust_loss4_anchs.h5', num_anchors, num_classes)
+        convert_keras(model, tuple(args.size) + (3, ), detector_data(annotations, args.buses, args.size),
+                      args.output_path)
+    else:
+        from classification_train import get_resnet50
+        model = get_resnet50(num_classes=6, w=None)
+        model.load_weights(args.weights or 'resnet50_best.h5')
+        convert_keras(model, (224, 224, 3), classifier_data(annotations, args.buses, args.samples),
+                      args.output_path)
+
+
+if __name__ == '__main__':
+    _main()
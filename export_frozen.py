@@ -0,0 +1,86 @@
+"""
+Export a YOLO model as one frozen inference graph (.pb).
+
+The graph takes a letterboxed uint8 image and returns the filtered boxes:
+in-graph normalisation, the model, yolo_head decoding with constant grids
+(static input size) and NMS, with variables and the learning phase folded
+into constants. Load it with YOLO(model_path='model.pb', ...).
+
+Graph inputs:  image_input (1, h, w, 3) uint8, image_shape (2,) float32 (h, w the boxes are scaled to, YOLO feeds the input size),
+               score_threshold, iou_threshold, max_boxes (optional, default to the export values)
+Graph outputs: boxes, scores, classes
+"""
+import argparse
+import os
+
+import tensorflow as tf
+from keras import backend as K
+
+from yolo import YOLO
+from yolo3.model import yolo_eval
+
+INPUT_NAMES = ['image_input', 'image_shape', 'score_threshold', 'iou_threshold', 'max_boxes']
+OUTPUT_NAMES = ['boxes', 'scores', 'classes']
+
+
+def export_frozen(output_path, **yolo_args):
+    '''Build the inference graph of YOLO(**yolo_args) and write it frozen to output_path'''
+    K.clear_session()
+    # No learning phase placeholder: batch norm and friends are built in inference mode.
+    K.set_learning_phase(0)
+    yolo = YOLO(**yolo_args)
+    h, w = yolo.model_image_size
+    assert h is not None and w is not None, 'A fixed model_image_size is required for export'
+
+    image_input = tf.placeholder(tf.uint8, shape=(1, h, w, 3), name='image_input')
+    image_shape = tf.placeholder(tf.float32, shape=(2,), name='image_shape')
+    score = tf.placeholder_with_default(float(yolo.score), shape=(), name='score_threshold')
+    iou = tf.placeholder_with_default(float(yolo.iou), shape=(), name='iou_threshold')
+    max_boxes = tf.placeholder_with_default(int(yolo.max_boxes), shape=(), name='max_boxes')
+
+    yolo_outputs = yolo.yolo_model(K.cast(image_input, 'float32') / 255.)
+    boxes, scores, classes = yolo_eval(yolo_outputs, yolo.anchors, len(yolo.class_names), image_shape,
+                                       max_boxes=max_boxes, score_threshold=score, iou_threshold=iou,
+                                       nms_mode=yolo.nms_mode)
+    for tensor, name in zip([boxes, scores, classes], OUTPUT_NAMES):
+        tf.identity(tensor, name=name)
+
+    graph_def = tf.graph_util.convert_variables_to_constants(
+        yolo.sess, yolo.sess.graph.as_graph_def(), OUTPUT_NAMES)
+    graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=INPUT_NAMES + OUTPUT_NAMES)
+    try:
+        from tensorflow.tools.graph_transforms import TransformGraph
+    except ImportError:
+        print('tensorflow graph_transforms not available, skipping constant folding')
+    else:
+        graph_def = TransformGraph(graph_def, INPUT_NAMES, OUTPUT_NAMES, [
+            'fold_constants(ignore_errors=true)',
+            'fold_batch_norms',
+            'fold_old_batch_norms',
+        ])
+
+    output_dir, output_name = os.path.split(os.path.abspath(output_path))
+    tf.train.write_graph(graph_def, output_dir, output_name, as_text=False)
+    print('frozen graph with {} nodes written to {}'.format(len(graph_def.node), output_path))
+    yolo.close_session()
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Export a frozen YOLO inference graph.')
+    parser.add_argument('output_path', help='path of the .pb file to write')
+    parser.add_argument('--model', dest='model_path', default=YOLO.get_defaults('model_path'))
+    parser.add_argument('--anchors', dest='anchors_path', default=YOLO.get_defaults('anchors_path'))
+    parser.add_argument('--classes', dest='classes_path', default=YOLO.get_defaults('classes_path'))
+    parser.add_argument('--size', dest='model_image_size', type=int, nargs=2,
+                        default=YOLO.get_defaults('model_image_size'), help='input height and width')
+    parser.add_argument('--score', type=float, default=YOLO.get_defaults('score'))
+    parser.add_argument('--iou', type=float, default=YOLO.get_defaults('iou'))
+    parser.add_argument('--nms_mode', default=YOLO.get_defaults('nms_mode'))
+    args = vars(parser.parse_args())
+    output_path = args.pop('output_path')
+    args['model_image_size'] = tuple(args['model_image_size'])
+    export_frozen(output_path, **args)
+
+
+if __name__ == '__main__':
+    _main()
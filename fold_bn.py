@@ -0,0 +1,45 @@
+"""
+Fold the batch norms of a YOLO model into its convolutions and save the smaller model.
+
+The folded model is checked against the original on random images before it is saved.
+Load it like any other model: YOLO(model_path='folded.h5', ...).
+"""
+import argparse
+import sys
+
+from yolo3.fold import fold_batch_norm, check_folding
+from yolo3.model import load_yolo_model
+from train import get_classes, get_anchors
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Fold batch norms of a YOLO model into its convolutions.')
+    parser.add_argument('output_path', help='path of the folded .h5 model')
+    parser.add_argument('--model', dest='model_path', default='final_single_cust_loss4_anchs.h5')
+    parser.add_argument('--anchors', dest='anchors_path', default='bus_anchors.txt')
+    parser.add_argument('--classes', dest='classes_path', default='bus_classes_single.txt')
+    parser.add_argument('--size', type=int, nargs=2, default=[416, 416], help='check input height and width')
+    parser.add_argument('--rtol', type=float, default=1e-4,
+                        help='max output difference allowed, relative to the largest output')
+    args = parser.parse_args()
+
+    num_anchors = len(get_anchors(args.anchors_path))
+    num_classes = len(get_classes(args.classes_path))
+    model = load_yolo_model(args.model_path, num_anchors, num_classes)
+    folded = fold_batch_norm(model)
+    print('parameters: {} -> {}'.format(model.count_params(), folded.count_params()))
+
+    diffs, scales = check_folding(model, folded, input_shape=tuple(args.size) + (3, ))
+    ok = True
+    for i, (diff, scale) in enumerate(zip(diffs, scales)):
+        print('output {}: max abs difference {:.3g} (max abs output {:.3g})'.format(i, diff, scale))
+        ok = ok and diff <= args.rtol * max(scale, 1.)
+    if not ok:
+        print('folded model does not match the original, not saved')
+        sys.exit(1)
+    folded.save(args.output_path, include_optimizer=False)
+    print('saved {}'.format(args.output_path))
+
+
+if __name__ == '__main__':
+    _main()
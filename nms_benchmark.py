@@ -0,0 +1,68 @@
+"""
+Micro-benchmark of yolo3.nms against the legacy non_max_suppression_fast.
+"""
+import argparse
+from timeit import default_timer as timer
+
+import numpy as np
+
+from yolo3.nms import nms, non_max_suppression_fast
+
+
+def random_boxes(num_boxes, num_classes=6, image_size=(3000, 4000), num_objects=10, seed=0):
+    '''Candidate boxes jittered around a few objects, like a dense yolo output'''
+    rng = np.random.RandomState(seed)
+    h, w = image_size
+    centers = rng.uniform([0, 0], [h, w], size=(num_objects, 2))
+    sizes = rng.uniform(50, 800, size=(num_objects, 2))
+    owner = rng.randint(0, num_objects, size=num_boxes)
+    yx = centers[owner] + rng.normal(0, 20, size=(num_boxes, 2))
+    hw = sizes[owner] * rng.uniform(0.8, 1.2, size=(num_boxes, 2))
+    boxes = np.concatenate([yx - hw / 2., yx + hw / 2.], axis=1).astype('float32')
+    scores = rng.uniform(0.3, 1., size=num_boxes).astype('float32')
+    classes = rng.randint(0, num_classes, size=num_boxes).astype('int32')
+    return boxes, scores, classes
+
+
+def time_call(f, repeat):
+    '''Return the median wall time of repeat calls of f, in ms'''
+    times = []
+    for _ in range(repeat):
+        start = timer()
+        f()
+        times.append(timer() - start)
+    return 1e3 * float(np.median(times))
+
+
+def run_benchmark(sizes=(50, 200, 500, 1000), repeat=20, iou_threshold=0.3):
+    '''Return a list of (num_boxes, implementation, median ms)'''
+    results = []
+    for num_boxes in sizes:
+        boxes, scores, classes = random_boxes(num_boxes)
+        candidates = [
+            ('non_max_suppression_fast', lambda: non_max_suppression_fast(boxes, scores, classes, iou_threshold)),
+            ('greedy', lambda: nms(boxes, scores, iou_threshold=iou_threshold)),
+            ('greedy class aware', lambda: nms(boxes, scores, classes, iou_threshold=iou_threshold)),
+            ('greedy top_k=100', lambda: nms(boxes, scores, iou_threshold=iou_threshold, top_k=100)),
+            ('soft', lambda: nms(boxes, scores, method='soft', score_threshold=0.05)),
+            ('matrix', lambda: nms(boxes, scores, method='matrix', score_threshold=0.05)),
+        ]
+        for name, f in candidates:
+            results.append((num_boxes, name, time_call(f, repeat)))
+    return results
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='NMS micro-benchmark.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 200, 500, 1000],
+                        help='numbers of candidate boxes')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print('{:>6}  {:<26}{:>10}'.format('boxes', 'implementation', 'ms'))
+    for num_boxes, name, ms in run_benchmark(args.sizes, args.repeat):
+        print('{:>6}  {:<26}{:>10.3f}'.format(num_boxes, name, ms))
+
+
+if __name__ == '__main__':
+    _main()
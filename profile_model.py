@@ -0,0 +1,75 @@
+"""
+Per-layer parameters, FLOPs, activation memory and CPU latency of the detection and
+classification networks at a given input size, summed per darknet stage and detection head.
+
+    python profile_model.py yolo --size 416 416
+    python profile_model.py tiny --size 320 320 --layers
+    python profile_model.py resnet50 --size 224 224 --json resnet50.json
+"""
+import argparse
+import json
+
+from keras import backend as K
+from keras.layers import Input
+
+from yolo3.layer_profile import profile_model
+
+RESNETS = {
+    'resnet18': ((2, 2, 2, 2), 'basic'),
+    'resnet34': ((3, 4, 6, 3), 'basic'),
+    'resnet50': ((3, 4, 6, 3), 'usual'),
+}
+
+
+def build(network, num_anchors, num_classes):
+    '''The network with a (None, None, 3) input, profile_model fixes the size'''
+    if network in RESNETS:
+        from classification_models.resnet.builder import build_resnet
+        repetitions, block_type = RESNETS[network]
+        return build_resnet(repetitions, input_shape=(224, 224, 3), classes=num_classes, block_type=block_type)
+    from yolo3.model import yolo_body, tiny_yolo_body
+    body = tiny_yolo_body if network == 'tiny' else yolo_body
+    return body(Input(shape=(None, None, 3)), num_anchors, num_classes)
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Per-layer profile of the YOLO and resnet networks.')
+    parser.add_argument('network', choices=['yolo', 'tiny'] + sorted(RESNETS))
+    parser.add_argument('--size', type=int, nargs=2, default=[416, 416], help='input height and width')
+    parser.add_argument('--anchors', type=int, default=3, help='anchors per output scale')
+    parser.add_argument('--classes', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=10, help='timed runs per layer')
+    parser.add_argument('--no_latency', dest='latency', action='store_false', help='only count, do not time')
+    parser.add_argument('--layers', action='store_true', help='also print every layer')
+    parser.add_argument('--json', help='write the profile to this file')
+    args = parser.parse_args()
+
+    K.set_learning_phase(0)
+    model = build(args.network, args.anchors, args.classes)
+    layers, groups, total = profile_model(model, tuple(args.size) + (3, ), args.repeat, args.latency)
+
+    row = '{:<24} {:>10} {:>10} {:>10} {:>9} {:>7}'
+    if args.layers:
+        print(row.format('layer', 'params', 'MFLOPs', 'act MB', 'ms', 'group'))
+        for layer in layers:
+            print(row.format(layer['name'][:24], layer['params'], '{:.1f}'.format(layer['flops'] / 1e6),
+                             '{:.2f}'.format(layer['activation_bytes'] / 2.**20),
+                             '{:.3f}'.format(1e3 * layer['latency_s']), layer['group']))
+        print('')
+    print(row.format('group', 'params', 'GFLOPs', 'act MB', 'ms', 'ms %'))
+    for name, group in list(groups.items()) + [('total', total)]:
+        print(row.format(name, group['params'], '{:.2f}'.format(group['flops'] / 1e9),
+                         '{:.1f}'.format(group['activation_bytes'] / 2.**20), '{:.2f}'.format(1e3 * group['latency_s']),
+                         '{:.1%}'.format(group['latency_s'] / max(total['latency_s'], 1e-12))))
+    if 'end_to_end_latency_s' in total:
+        print('end to end {:.2f} ms per image, the per layer sum is {:.2f} ms'.format(
+            1e3 * total['end_to_end_latency_s'], 1e3 * total['latency_s']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'network': args.network, 'size': args.size, 'layers': layers, 'groups': groups,
+                       'total': total}, f, indent=2)
+
+
+if __name__ == '__main__':
+    _main()
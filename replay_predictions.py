@@ -0,0 +1,112 @@
+"""
+Sweep score / iou thresholds over a prediction cache (yolo_video.py --cache)
+and score every point with the busProjectTest F1, without running the detector.
+"""
+import argparse
+import itertools
+import os
+from timeit import default_timer as timer
+
+from yolo3.annotations import format_detections
+from yolo3.cache import PredictionCache
+from yolo3.nms import nms, per_class_nms
+from busProjectTest import evaluate
+
+
+def replay(predictions, score, iou, max_boxes=20, nms_method='greedy', nms_iou=0.3,
+           nms_class_aware=False, classify=None, remap=True, nms_score=None, nms_top_k=100):
+    '''Return the annotation lines of all cached images at one (score, iou) point
+
+    Mirrors YOLO.detect_image: yolo_eval per_class NMS, then the host side nms.
+    nms_score: floor of the 'soft' / 'matrix' decayed scores, default score
+    nms_top_k: boxes entering the host side nms, like YOLO nms_top_k
+    classify: optional callable (name, rows, boxes) -> classes replacing the detector classes
+    '''
+    lines = []
+    for name, image_size, boxes, box_scores in predictions:
+        index, scores, classes = per_class_nms(boxes, box_scores, score, iou, max_boxes)
+        keep, _ = nms(boxes[index], scores, classes if nms_class_aware else None,
+                      iou_threshold=nms_iou, method=nms_method,
+                      score_threshold=score if nms_score is None else nms_score, top_k=nms_top_k)
+        rows = index[keep]
+        out_boxes = boxes[rows].astype('int')
+        out_classes = classes[keep]
+        if classify is not None:
+            out_classes = classify(name, rows, out_boxes)
+        line = format_detections(name, out_boxes, out_classes, image_size, remap)
+        if line is not None:
+            lines.append(line)
+    return lines
+
+
+class CachedClassifier(object):
+    '''predict_class over cached boxes, each cached row is classified at most once per sweep'''
+
+    def __init__(self, classifier, busDir):
+        self.classifier = {'resnet50': classifier}
+        self.busDir = busDir
+        self.memo = {}
+
+    def __call__(self, name, rows, boxes):
+        # Imported here so that plain sweeps do not need keras.
+        from PIL import Image
+        from classification_train import predict_class
+
+        missing = [i for i, row in enumerate(rows) if (name, row) not in self.memo]
+        if missing:
+            image = Image.open(os.path.join(self.busDir, name))
+            for i, y in zip(missing, predict_class(image, boxes[missing], self.classifier)):
+                self.memo[(name, rows[i])] = y
+        return [self.memo[(name, row)] for row in rows]
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Threshold sweep over cached predictions.')
+    parser.add_argument('--cache', required=True, help='cache directory written by yolo_video.py --cache')
+    parser.add_argument('--anns', required=True, help='ground truth annotations file')
+    parser.add_argument('--score', type=float, nargs='+', default=[0.3])
+    parser.add_argument('--iou', type=float, nargs='+', default=[0.6])
+    parser.add_argument('--max_boxes', type=int, default=20)
+    parser.add_argument('--nms_method', default='greedy')
+    parser.add_argument('--nms_iou', type=float, default=0.3)
+    parser.add_argument('--nms_top_k', type=int, default=100, help='boxes entering the host side nms')
+    parser.add_argument('--nms_score', type=float, help="floor of the 'soft' / 'matrix' decayed scores, default --score")
+    parser.add_argument('--ignore_color', action='store_true', help='match boxes by IOU only')
+    parser.add_argument('--classify', metavar='BUS_DIR',
+                        help='color the boxes with the resnet50 post classifier, images read from BUS_DIR')
+    parser.add_argument('--classifier_weights', default='resnet50_best.h5')
+    parser.add_argument('--out', help='write the annotations of the best point to this file')
+    args = parser.parse_args()
+
+    with open(args.anns) as f:
+        gtLines = f.readlines()
+    predictions = list(PredictionCache(args.cache))
+    print('{} cached images'.format(len(predictions)))
+
+    classify = None
+    if args.classify:
+        from classification_train import get_resnet50
+        resnet50 = get_resnet50(num_classes=6, w=None)
+        resnet50.load_weights(args.classifier_weights)
+        classify = CachedClassifier(resnet50, args.classify)
+
+    best = None
+    print('{:>6} {:>6} {:>5} {:>5} {:>5} {:>7} {:>8}'.format('score', 'iou', 'TP', 'FP', 'MISS', 'F1', 'sec'))
+    for score, iou in itertools.product(args.score, args.iou):
+        start = timer()
+        lines = replay(predictions, score, iou, args.max_boxes, args.nms_method, args.nms_iou, classify=classify,
+                       nms_score=args.nms_score, nms_top_k=args.nms_top_k)
+        TP, FP, MISS, F1 = evaluate(gtLines, lines, ignoreColor=args.ignore_color)
+        print('{:>6.3f} {:>6.3f} {:>5} {:>5} {:>5} {:>7.3f} {:>8.2f}'.format(
+            score, iou, TP, FP, MISS, F1, timer() - start))
+        if best is None or F1 > best[0]:
+            best = (F1, score, iou, lines)
+
+    print('best F1 {:.3f} at score {} iou {}'.format(*best[:3]))
+    if args.out:
+        with open(args.out, 'w') as of:
+            of.writelines(best[3])
+
+
+if __name__ == '__main__':
+    _main()
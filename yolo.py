@@ -5,6 +5,7 @@ Class definition of YOLO_v3 style detection model on image and video
 
 import colorsys
 import os
+from itertools import islice, repeat
 from timeit import default_timer as timer
 import logging
 
@@ -12,75 +13,21 @@ import logging
 
 
 import numpy as np
+import tensorflow as tf
 from keras import backend as K
-from keras.models import load_model
-from keras.layers import Input
 from PIL import Image, ImageFont, ImageDraw
 
-from yolo3.model import yolo_eval, yolo_body, tiny_yolo_body
-from yolo3.utils import letterbox_image
+from yolo3.model import yolo_eval, yolo_decode, load_yolo_model
+from yolo3.fold import fold_batch_norm
+from yolo3.utils import Letterboxer, correct_boxes, scale_boxes, tile_grid
+from yolo3.nms import nms, non_max_suppression_fast, fuse_boxes, per_class_nms
+from yolo3.cascade import CascadePolicy, CascadeStats
+from yolo3.profiling import latency
+from yolo3.session import configure_session
 import os
 from keras.utils import multi_gpu_model
 
 
-# Malisiewicz et al.
-def non_max_suppression_fast(boxes, scores, classes, overlapThresh=0.3):
-    # if there are no boxes, return an empty list
-    if len(boxes) == 0:
-        return []
-
-    # if the bounding boxes integers, convert them to floats --
-    # this is important since we'll be doing a bunch of divisions
-    if boxes.dtype.kind == "i":
-        boxes = boxes.astype("float")
-
-    # initialize the list of picked indexes
-    pick = []
-
-    # grab the coordinates of the bounding boxes
-    x1 = boxes[:, 0]
-    y1 = boxes[:, 1]
-    x2 = boxes[:, 3]
-    y2 = boxes[:, 2]
-
-    # compute the area of the bounding boxes and sort the bounding
-    # boxes by the bottom-right y-coordinate of the bounding box
-    area = (x2 - x1 + 1) * (y2 - y1 + 1)
-    idxs = np.argsort(y2)
-
-    # keep looping while some indexes still remain in the indexes
-    # list
-    while len(idxs) > 0:
-        # grab the last index in the indexes list and add the
-        # index value to the list of picked indexes
-        last = len(idxs) - 1
-        i = idxs[last]
-        pick.append(i)
-
-        # find the largest (x, y) coordinates for the start of
-        # the bounding box and the smallest (x, y) coordinates
-        # for the end of the bounding box
-        xx1 = np.maximum(x1[i], x1[idxs[:last]])
-        yy1 = np.maximum(y1[i], y1[idxs[:last]])
-        xx2 = np.minimum(x2[i], x2[idxs[:last]])
-        yy2 = np.minimum(y2[i], y2[idxs[:last]])
-
-        # compute the width and height of the bounding box
-        w = np.maximum(0, xx2 - xx1 + 1)
-        h = np.maximum(0, yy2 - yy1 + 1)
-
-        # compute the ratio of overlap
-        overlap = (w * h) / area[idxs[:last]]
-
-        # delete all indexes from the index list that have
-        idxs = np.delete(idxs, np.concatenate(([last],
-                                               np.where(overlap > overlapThresh)[0])))
-
-    # return only the bounding boxes that were picked using the
-    # integer data type
-    return boxes[pick].astype("int"), scores[pick], classes[pick]
-
-
 class YOLO(object):
     _defaults = {
         "model_path": 'model_data/yolo_weights.h5',
@@ -88,8 +35,36 @@ class YOLO(object):
         "classes_path": 'model_data/bus_classes.txt',
         "score" : 0.3,
         "iou" : 0.6,
+        "max_boxes" : 20,
         "model_image_size" : (416, 416),
+        "shape_buckets" : None, # (h, w) input shapes picked by image aspect, see yolo3.utils.shape_buckets
+        "letterbox_resample" : 'bicubic',
+        "letterbox_backend" : None, # 'pil' (default, as in training) or 'cv2', see yolo3.utils.Letterboxer
         "gpu_num" : 1,
+        "intra_op_threads" : None, # tensorflow thread pools and cpu list of the process, see yolo3.session
+        "inter_op_threads" : None,
+        "cpu_affinity" : None,
+        "backend" : 'tf', # 'tflite': model_path is a .tflite file written by convert_tflite.py
+        "fold_bn" : False, # fold batch norms into the convs after loading, see yolo3.fold
+        "nms_mode" : 'per_class', # 'per_class', 'batched' or 'combined' (TF >= 1.15), see yolo3.model.yolo_eval
+        "nms_method" : 'greedy',
+        "nms_iou" : 0.3,
+        "nms_class_aware" : False,
+        "nms_top_k" : 100, # only the best boxes enter the host side NMS, bounds its cost in dense scenes
+        "nms_score" : None, # drops boxes 'soft' / 'matrix' decayed below it, default the detection score
+        "tile_size" : None, # (w, h) in image pixels, default the model input size
+        "tile_overlap" : 0.25,
+        "tile_max" : 12,
+        "tile_full_pass" : True,
+        "tile_fuse_ios" : 0.6,
+        "cascade_sizes" : None, # e.g. [(320, 320), (608, 608)], detect_image escalates through them
+        "cascade_policy" : None, # yolo3.cascade.CascadePolicy, default CascadePolicy()
+        "gate_model_path" : None, # tiny YOLO run before the full model, see _generate_gate
+        "gate_anchors_path" : 'model_data/tiny_yolo_anchors.txt',
+        "gate_size" : None, # (h, w), default model_image_size
+        "gate_policy" : None, # when the gate escalates to the full model, default cascade_policy
+        "latency_registry" : None, # yolo3.profiling.LatencyRegistry of the stage timings, default the process wide one
+        "trace_sampler" : None, # yolo3.profiling.TraceSampler, traces a sample of the sess.run calls
     }
 
     @classmethod
@@ -104,8 +79,29 @@ class YOLO(object):
         self.__dict__.update(kwargs) # and update with user overrides
         self.class_names = self._get_class()
         self.anchors = self._get_anchors()
-        self.sess = K.get_session()
+        self.sess = configure_session(self.intra_op_threads, self.inter_op_threads, self.cpu_affinity)
+        self.latency = self.latency_registry or latency
+        self.frozen = self.model_path.endswith('.pb')
+        self.tflite = self.backend == 'tflite'
         self.boxes, self.scores, self.classes = self.generate()
+        self._batch_outputs = {}  # batch size -> per image (boxes, scores, classes) tensors
+        self.fused_classes = None
+        self._letterboxers = {}  # (w, h) -> Letterboxer
+        self._batch_buffers = {}  # (h, w) -> uint8 batch input array
+        assert not ((self.frozen or self.tflite) and (self.cascade_sizes or self.gate_model_path)), \
+            'Frozen graphs and TFLite models have a single input size and model, no cascade'
+        if self.cascade_policy is None:
+            self.cascade_policy = CascadePolicy()
+        # (name, (image_input, image_shape, boxes, scores, classes) or None for this model, (h, w), policy)
+        self.cascade_stages = [('{}x{}'.format(*size), None, tuple(size), self.cascade_policy)
+                               for size in self.cascade_sizes or ()]
+        if self.gate_model_path:
+            self.cascade_stages.insert(0, ('gate', self._generate_gate(), self.gate_size,
+                                           self.gate_policy or self.cascade_policy))
+            if len(self.cascade_stages) == 1:
+                self.cascade_stages.append(('full', None, None, None))
+        self.cascade_stats = CascadeStats(stage[0] for stage in self.cascade_stages)
+        self.last_stage = None
 
         print("class path {}, using classes : {}".format(self.classes_path, str(self.class_names)))
 
@@ -117,8 +113,8 @@ class YOLO(object):
         class_names = [c.strip() for c in class_names]
         return class_names
 
-    def _get_anchors(self):
-        anchors_path = os.path.expanduser(self.anchors_path)
+    def _get_anchors(self, anchors_path=None):
+        anchors_path = os.path.expanduser(anchors_path or self.anchors_path)
         print("model path : {}".format(anchors_path))
         with open(anchors_path) as f:
             anchors = f.readline()
@@ -129,25 +125,54 @@ class YOLO(object):
     def generate(self):
         model_path = os.path.expanduser(self.model_path)
         print("model path : {}".format(model_path))
-        assert model_path.endswith('.h5'), 'Keras model or weights must be a .h5 file.'
-
-        # Load model, or construct model and load weights.
-        num_anchors = len(self.anchors)
-        num_classes = len(self.class_names)
-        is_tiny_version = num_anchors==6 # default setting
-        try:
-            self.yolo_model = load_model(model_path, compile=False)
-        except:
-            self.yolo_model = tiny_yolo_body(Input(shape=(None,None,3)), num_anchors//2, num_classes) \
-                if is_tiny_version else yolo_body(Input(shape=(None,None,3)), num_anchors//3, num_classes)
-            self.yolo_model.load_weights(self.model_path) # make sure model, anchors and classes match
-        else:
-            assert self.yolo_model.layers[-1].output_shape[-1] == \
-                num_anchors/len(self.yolo_model.output) * (num_classes + 5), \
-                'Mismatch between model and given anchor and class sizes'
+        if self.frozen:
+            return self._load_frozen(model_path)
+        if self.tflite:
+            return self._load_tflite(model_path)
+        assert model_path.endswith('.h5'), 'Keras model or weights must be a .h5 file (or a frozen .pb graph).'
 
-        print('{} model, anchors, and classes loaded.'.format(model_path))
+        self.yolo_model = self._load_model(model_path, self.anchors)
+        self._generate_colors()
+
+        # Generate output tensor targets for filtered bounding boxes.
+        self.input_image_shape = K.placeholder(shape=(2, ))
+        # Thresholds default to the constructor values but can be fed per sess.run.
+        self.score_tensor = tf.placeholder_with_default(float(self.score), shape=())
+        self.iou_tensor = tf.placeholder_with_default(float(self.iou), shape=())
+        self.max_boxes_tensor = tf.placeholder_with_default(int(self.max_boxes), shape=())
+        if self.gpu_num>=2:
+            self.yolo_model = multi_gpu_model(self.yolo_model, gpus=self.gpu_num)
+        # Images are fed as uint8, the cast and scaling to [0, 1] run in-graph.
+        self.image_input = K.placeholder(shape=(None, None, None, 3), dtype='uint8')
+        self.yolo_outputs = self.yolo_model(K.cast(self.image_input, 'float32') / 255.)
+        boxes, scores, classes = yolo_eval(self.yolo_outputs, self.anchors,
+                len(self.class_names), self.input_image_shape, max_boxes=self.max_boxes_tensor,
+                score_threshold=self.score_tensor, iou_threshold=self.iou_tensor, nms_mode=self.nms_mode)
+        return boxes, scores, classes
 
+    def _load_model(self, model_path, anchors):
+        '''Load model, or construct model and load weights'''
+        model = load_yolo_model(model_path, len(anchors), len(self.class_names))
+        print('{} model, anchors, and classes loaded.'.format(model_path))
+        if self.fold_bn:
+            model = fold_batch_norm(model)
+        return model
+
+    def _generate_gate(self):
+        '''Load the gate model (e.g. tiny_yolo_body) next to the full one, returns its cascade stage tensors
+
+        The gate shares the classes and the score / iou / max_boxes placeholders of the full model.
+        '''
+        gate_anchors = self._get_anchors(self.gate_anchors_path)
+        self.gate_model = self._load_model(os.path.expanduser(self.gate_model_path), gate_anchors)
+        image_input = K.placeholder(shape=(None, None, None, 3), dtype='uint8')
+        image_shape = K.placeholder(shape=(2, ))
+        boxes, scores, classes = yolo_eval(self.gate_model(K.cast(image_input, 'float32') / 255.), gate_anchors,
+                len(self.class_names), image_shape, max_boxes=self.max_boxes_tensor,
+                score_threshold=self.score_tensor, iou_threshold=self.iou_tensor, nms_mode=self.nms_mode)
+        return image_input, image_shape, boxes, scores, classes
+
+    def _generate_colors(self):
         # Generate colors for drawing bounding boxes.
         hsv_tuples = [(x / len(self.class_names), 1., 1.)
                       for x in range(len(self.class_names))]
@@ -159,59 +184,416 @@ class YOLO(object):
         np.random.shuffle(self.colors)  # Shuffle colors to decorrelate adjacent classes.
         np.random.seed(None)  # Reset seed to default.
 
-        # Generate output tensor targets for filtered bounding boxes.
-        self.input_image_shape = K.placeholder(shape=(2, ))
-        if self.gpu_num>=2:
-            self.yolo_model = multi_gpu_model(self.yolo_model, gpus=self.gpu_num)
-        boxes, scores, classes = yolo_eval(self.yolo_model.output, self.anchors,
-                len(self.class_names), self.input_image_shape,
-                score_threshold=self.score, iou_threshold=self.iou)
-        return boxes, scores, classes
+    def _load_frozen(self, model_path):
+        '''Import a graph written by export_frozen.py, returns its boxes, scores, classes tensors'''
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(model_path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        tf.import_graph_def(graph_def, name='frozen')
+        get_tensor = lambda name: self.sess.graph.get_tensor_by_name('frozen/{}:0'.format(name))
+        print('{} frozen graph loaded.'.format(model_path))
+
+        self._generate_colors()
+        self.image_input = get_tensor('image_input')
+        self.model_image_size = tuple(self.image_input.shape.as_list()[1:3])
+        self.input_image_shape = get_tensor('image_shape')
+        self.score_tensor = get_tensor('score_threshold')
+        self.iou_tensor = get_tensor('iou_threshold')
+        self.max_boxes_tensor = get_tensor('max_boxes')
+        return get_tensor('boxes'), get_tensor('scores'), get_tensor('classes')
+
+    def _load_tflite(self, model_path):
+        '''Load a model written by convert_tflite.py, decode and NMS then run on the host'''
+        from yolo3.tflite import TFLiteModel
+        self.tflite_model = TFLiteModel(model_path)
+        self.model_image_size = self.tflite_model.input_shape[:2]
+        print('{} TFLite model loaded.'.format(model_path))
+        self._generate_colors()
+        return None, None, None
+
+    def fuse_classifier(self, classifier):
+        '''Run the post classifier on the detected boxes inside the detection sess.run
+
+        classifier: keras model, e.g. classification_train.get_resnet50. Once fused,
+        detect_image reports the classifier classes and ignores classification_cb.
+        '''
+        assert not (self.frozen or self.tflite), 'fuse_classifier needs the keras model, not a frozen graph or TFLite model'
+        from classification_train import crop_and_classify
+        self.original_image = K.placeholder(shape=(1, None, None, 3), dtype='uint8')
+        # dy, dx, scale_y, scale_x of the letterbox, to crop self.boxes from the original image.
+        self.letterbox_params = K.placeholder(shape=(4, ))
+        offset = K.tile(self.letterbox_params[:2], [2])
+        scale = K.tile(self.letterbox_params[2:], [2])
+        self.fused_classes = crop_and_classify(K.cast(self.original_image, 'float32'),
+                                               (self.boxes - offset) / scale, classifier)
+
+    def _batch_eval(self, batch_size):
+        '''Build (once per batch size) yolo_eval outputs for each element of a batch'''
+        if batch_size not in self._batch_outputs:
+            if not hasattr(self, 'input_image_shapes'):
+                self.input_image_shapes = K.placeholder(shape=(None, 2))
+            outputs = []
+            for b in range(batch_size):
+                yolo_outputs = [output[b:b + 1] for output in self.yolo_outputs]
+                outputs.append(yolo_eval(yolo_outputs, self.anchors,
+                        len(self.class_names), self.input_image_shapes[b], max_boxes=self.max_boxes_tensor,
+                        score_threshold=self.score_tensor, iou_threshold=self.iou_tensor, nms_mode=self.nms_mode))
+            self._batch_outputs[batch_size] = outputs
+        return self._batch_outputs[batch_size]
+
+    def _extra_feed(self, score=None, iou=None, max_boxes=None):
+        '''Learning phase and threshold override feed dict entries'''
+        if self.frozen:
+            # Frozen graphs have no learning phase. Their thresholds default to the export values,
+            # so the constructor ones are always fed, as they are baked into the keras graph.
+            feed = {}
+            score = self.score if score is None else score
+            iou = self.iou if iou is None else iou
+            max_boxes = self.max_boxes if max_boxes is None else max_boxes
+        else:
+            feed = {K.learning_phase(): 0}
+        if score is not None:
+            feed[self.score_tensor] = score
+        if iou is not None:
+            feed[self.iou_tensor] = iou
+        if max_boxes is not None:
+            feed[self.max_boxes_tensor] = max_boxes
+        return feed
+
+    def _sess_run(self, fetches, feed_dict, name='detect_image'):
+        '''sess.run, traced by trace_sampler when it samples this call of name'''
+        if self.trace_sampler is None:
+            return self.sess.run(fetches, feed_dict=feed_dict)
+        return self.trace_sampler.run(self.sess, fetches, feed_dict, name)
+
+    def _input_size(self, image):
+        '''(h, w) the image is letterboxed to
+
+        The shape bucket closest to the image aspect ratio, else model_image_size,
+        or for a (None, None) model_image_size the image size rounded down to multiples of 32.
+        '''
+        if self.model_image_size == (None, None):
+            return (image.height - (image.height % 32), image.width - (image.width % 32))
+        if self.shape_buckets and not (self.frozen or self.tflite):
+            aspect = np.log(image.width / image.height)
+            return min(self.shape_buckets, key=lambda hw: abs(np.log(hw[1] / hw[0]) - aspect))
+        return tuple(self.model_image_size)
+
+    def _letterbox(self, image, out=None, size=None):
+        '''Letterbox image to the model input size, to size (h, w), or to the size of out
+
+        Returns the uint8 array fed to image_input (a reused buffer unless out is given)
+        and the LetterboxMeta that maps boxes on it back to the image.
+        '''
+        h, w = out.shape[:2] if out is not None else size or self._input_size(image)
+        assert h%32 == 0 and w%32 == 0, 'Multiples of 32 required'
+        size = (w, h)
+        letterboxer = self._letterboxers.get(size)
+        if letterboxer is None:
+            letterboxer = Letterboxer(size, self.letterbox_resample, self.letterbox_backend)
+            # A (None, None) model size follows every image size, caching would keep a buffer per size seen.
+            if self.model_image_size != (None, None):
+                self._letterboxers[size] = letterboxer
+        with self.latency.time('letterbox'):
+            image_data, meta = letterboxer(image, out)
 
-    def detect_image(self, image, classification_cb=None, classification_cb_args=None, visualize=False):
+        logging.debug(image_data.shape)
+        return image_data, meta
+
+    def detect_image(self, image, classification_cb=None, classification_cb_args=None, visualize=False,
+                     score=None, iou=None, max_boxes=None, original_size=None):
+        '''score, iou and max_boxes override the constructor values for this call only
+
+        original_size: (w, h) of the full image when image was decoded at a reduced
+            resolution (yolo3.utils.open_image), returned boxes are scaled to it.
+        With cascade_sizes or a gate_model_path the image runs through the cascade, see _run_cascade.
+        Stage durations are recorded in self.latency, the whole call as 'detect_image'.
+        '''
         start = timer()
 
-        if self.model_image_size != (None, None):
-            assert self.model_image_size[0]%32 == 0, 'Multiples of 32 required'
-            assert self.model_image_size[1]%32 == 0, 'Multiples of 32 required'
-            boxed_image = letterbox_image(image, tuple(reversed(self.model_image_size)))
+        if self.cascade_stages:
+            out_boxes, out_scores, out_classes, fused_classes = self._run_cascade(image, score, iou, max_boxes)
         else:
-            new_image_size = (image.width - (image.width % 32),
-                              image.height - (image.height % 32))
-            boxed_image = letterbox_image(image, new_image_size)
-        image_data = np.array(boxed_image, dtype='float32')
+            out_boxes, out_scores, out_classes, fused_classes = self._run_image(image, None, score, iou, max_boxes)
 
-        logging.debug(image_data.shape)
-        image_data /= 255.
-        image_data = np.expand_dims(image_data, 0)  # Add batch dimension.
+        result = self._finalize(image, out_boxes, out_scores, out_classes,
+                                classification_cb, classification_cb_args, visualize, fused_classes, original_size,
+                                score)
 
-        out_boxes, out_scores, out_classes = self.sess.run(
-            [self.boxes, self.scores, self.classes],
-            feed_dict={
-                self.yolo_model.input: image_data,
-                self.input_image_shape: [image.size[1], image.size[0]],
-                K.learning_phase(): 0
-            })
+        end = timer()
+        self.latency.record('detect_image', end - start)
+        logging.debug(end - start)
+        return result
+
+    def _run_image(self, image, size=None, score=None, iou=None, max_boxes=None, tensors=None):
+        '''One sess.run on image letterboxed to size, returns boxes (image pixels), scores, classes, fused classes
+
+        tensors: (image_input, image_shape, boxes, scores, classes) of another model, default this one
+        '''
+        if self.tflite:
+            return self._run_tflite(image, score, iou, max_boxes)
+        image_data, meta = self._letterbox(image, size=size)
+        image_input, image_shape, boxes, scores, classes = tensors or (
+            self.image_input, self.input_image_shape, self.boxes, self.scores, self.classes)
+
+        # The graph reports boxes on the letterboxed image, correct_boxes maps them back.
+        fused = self.fused_classes is not None and tensors is None
+        with self.latency.time('host_to_tensor'):
+            feed_dict = {
+                image_input: np.expand_dims(image_data, 0),  # Add batch dimension.
+                image_shape: image_data.shape[:2],
+            }
+            feed_dict.update(self._extra_feed(score, iou, max_boxes))
+            if fused:
+                feed_dict[self.original_image] = np.expand_dims(np.asarray(image.convert('RGB')), 0)
+                feed_dict[self.letterbox_params] = [meta.dy, meta.dx, meta.scale_y, meta.scale_x]
+        with self.latency.time('sess_run'):
+            if not fused:
+                out_boxes, out_scores, out_classes = self._sess_run([boxes, scores, classes], feed_dict)
+                fused_classes = None
+            else:
+                out_boxes, out_scores, out_classes, fused_classes = self._sess_run(
+                    [boxes, scores, classes, self.fused_classes], feed_dict)
+        return correct_boxes(out_boxes, meta), out_scores, out_classes, fused_classes
+
+    def _run_tflite(self, image, score=None, iou=None, max_boxes=None):
+        '''_run_image on the TFLite model, the yolo_eval decode and NMS run in numpy'''
+        image_data, meta = self._letterbox(image)
+        boxes, box_scores = self._decode_tflite(image_data)
+        with self.latency.time('host_decode'):
+            index, out_scores, out_classes = per_class_nms(
+                boxes, box_scores, self.score if score is None else score,
+                self.iou if iou is None else iou, self.max_boxes if max_boxes is None else max_boxes)
+        return correct_boxes(boxes[index], meta), out_scores, out_classes, None
+
+    def _decode_tflite(self, image_data):
+        from yolo3.tflite import yolo_decode_np
+        with self.latency.time('host_to_tensor'):
+            image_data = np.expand_dims(image_data, 0).astype('float32') / 255.
+        with self.latency.time('sess_run'):
+            yolo_outputs = self.tflite_model.run(image_data)
+        with self.latency.time('host_decode'):
+            return yolo_decode_np(yolo_outputs, self.anchors, len(self.class_names), image_data.shape[1:3])
+
+    def _run_cascade(self, image, score=None, iou=None, max_boxes=None):
+        '''Run the cascade stages in order until cascade_policy settles the image
+
+        The stage the image ended at is left in last_stage and counted in cascade_stats.
+        '''
+        reasons = []
+        for stage, (name, tensors, size, policy) in enumerate(self.cascade_stages):
+            out = self._run_image(image, size, score, iou, max_boxes, tensors)
+            if stage == len(self.cascade_stages) - 1:
+                break
+            reason = policy.escalate(out[0], out[1], image.size)
+            if reason is None:
+                break
+            reasons.append(reason)
+        self.last_stage = name
+        self.cascade_stats.record(name, reasons)
+        logging.debug('cascade ended at {} ({})'.format(name, ', '.join(reasons) or 'settled'))
+        return out
+
+    def detect_images(self, images, batch_size=8, classification_cb=None, classification_cb_args=None, visualize=False,
+                      score=None, iou=None, max_boxes=None, original_sizes=None):
+        '''Detect on an iterable of PIL images, batch_size images per sess.run
+
+        Returns a list with one detect_image style result tuple per image.
+        original_sizes: optional iterable of detect_image original_size, one per image.
+        The cascade is per image, detect_images always runs at the bucket / model input size.
+        A fused classifier is not used here (images differ in size), pass classification_cb instead.
+        '''
+        assert self.model_image_size != (None, None), 'Batched detection requires a fixed model_image_size'
+        assert not self.frozen, 'Batched detection is not supported on frozen graphs'
+        if self.tflite:
+            # The interpreter runs one image at a time.
+            original_sizes = original_sizes if original_sizes is not None else repeat(None)
+            return [self.detect_image(image, classification_cb, classification_cb_args, visualize,
+                                      score, iou, max_boxes, original_size)
+                    for image, original_size in zip(images, original_sizes)]
+        results = []
+        images = iter(images)
+        original_sizes = iter(original_sizes) if original_sizes is not None else None
+        # Images share a batch only with images of the same shape bucket. Buckets are formed
+        # over a window of batch_size images per bucket, results keep the input order.
+        window = batch_size * max(1, len(self.shape_buckets or ()))
+        while True:
+            chunk = list(islice(images, window))
+            if not chunk:
+                break
+            if original_sizes is not None:
+                chunk_sizes = list(islice(original_sizes, len(chunk)))
+            else:
+                chunk_sizes = [None] * len(chunk)
+
+            buckets = {}
+            for i, image in enumerate(chunk):
+                buckets.setdefault(self._input_size(image), []).append(i)
+            chunk_results = [None] * len(chunk)
+            for shape, indices in sorted(buckets.items()):
+                for start in range(0, len(indices), batch_size):
+                    batch = indices[start:start + batch_size]
+                    batch_results = self._detect_batch(
+                        [chunk[i] for i in batch], shape, [chunk_sizes[i] for i in batch],
+                        classification_cb, classification_cb_args, visualize, score, iou, max_boxes)
+                    for i, result in zip(batch, batch_results):
+                        chunk_results[i] = result
+            results.extend(chunk_results)
+        return results
+
+    def _detect_batch(self, batch, shape, original_sizes, classification_cb, classification_cb_args, visualize,
+                      score, iou, max_boxes):
+        '''One sess.run of detect_images, on images letterboxed to shape (h, w)'''
+        start = timer()
+        image_data = self._batch_input(len(batch), shape)
+        metas = [self._letterbox(image, out=image_data[b])[1] for b, image in enumerate(batch)]
+        outputs = self._batch_eval(len(batch))  # creates input_image_shapes on first use
+        with self.latency.time('host_to_tensor'):
+            feed_dict = {
+                self.image_input: image_data,
+                self.input_image_shapes: [image_data.shape[1:3]] * len(batch),
+            }
+            feed_dict.update(self._extra_feed(score, iou, max_boxes))
+        with self.latency.time('sess_run'):
+            batch_out = self._sess_run(outputs, feed_dict, 'detect_batch')
+
+        results = []
+        for image, meta, original_size, (out_boxes, out_scores, out_classes) in zip(
+                batch, metas, original_sizes, batch_out):
+            results.append(self._finalize(image, correct_boxes(out_boxes, meta), out_scores, out_classes,
+                                          classification_cb, classification_cb_args, visualize,
+                                          original_size=original_size, score=score))
 
+        end = timer()
+        self.latency.record('detect_batch', end - start)
+        logging.debug('batch of {} {} : {}'.format(len(batch), shape, end - start))
+        return results
+
+    def detect_image_tiled(self, image, classification_cb=None, classification_cb_args=None, visualize=False,
+                           score=None, iou=None, max_boxes=None):
+        '''detect_image on overlapping tiles of the full resolution image, run as one batch
+
+        Tiles of tile_size overlap by tile_overlap and grow until at most tile_max cover the
+        image, which bounds the batch and so the latency. tile_full_pass adds the whole image
+        for objects larger than a tile. Pieces of an object cut by tile seams are fused into
+        one box (yolo3.nms.fuse_boxes) before the host side NMS.
+        '''
+        assert self.model_image_size != (None, None), 'Tiled detection requires a fixed model_image_size'
+        assert not (self.frozen or self.tflite), 'Tiled detection is not supported on frozen graphs or TFLite models'
+        start = timer()
+
+        tiles = tile_grid(image.size, self.tile_size or tuple(reversed(self.model_image_size)),
+                          self.tile_overlap, self.tile_max)
+        if self.tile_full_pass and len(tiles) > 1:
+            tiles.append((0, 0) + image.size)
+        image_data = self._batch_input(len(tiles))
+        metas = [self._letterbox(image.crop(tile), out=image_data[b])[1] for b, tile in enumerate(tiles)]
+        outputs = self._batch_eval(len(tiles))
+        with self.latency.time('host_to_tensor'):
+            feed_dict = {
+                self.image_input: image_data,
+                self.input_image_shapes: [image_data.shape[1:3]] * len(tiles),
+            }
+            feed_dict.update(self._extra_feed(score, iou, max_boxes))
+        with self.latency.time('sess_run'):
+            batch_out = self._sess_run(outputs, feed_dict, 'detect_tiled')
+
+        boxes, scores, classes, groups = [], [], [], []
+        for b, (tile, meta, (out_boxes, out_scores, out_classes)) in enumerate(zip(tiles, metas, batch_out)):
+            left, top = tile[:2]
+            boxes.append(correct_boxes(out_boxes, meta) + np.array([top, left, top, left], dtype='float32'))
+            scores.append(out_scores)
+            classes.append(out_classes)
+            groups.append(np.full(len(out_boxes), b))
+        out_boxes, out_scores, out_classes = fuse_boxes(
+            np.concatenate(boxes), np.concatenate(scores), np.concatenate(classes), np.concatenate(groups),
+            ios_threshold=self.tile_fuse_ios)
+
+        result = self._finalize(image, out_boxes, out_scores, out_classes,
+                                classification_cb, classification_cb_args, visualize, score=score)
+
+        end = timer()
+        self.latency.record('detect_image_tiled', end - start)
+        logging.debug('{} tiles : {}'.format(len(tiles), end - start))
+        return result
+
+    def _batch_input(self, batch_size, shape=None):
+        '''Reused uint8 input array for batch_size images letterboxed to shape (h, w), default model_image_size'''
+        shape = tuple(shape or self.model_image_size)
+        buffer = self._batch_buffers.get(shape)
+        if buffer is None or len(buffer) < batch_size:
+            buffer = self._batch_buffers[shape] = np.empty((batch_size, ) + shape + (3, ), dtype='uint8')
+        return buffer[:batch_size]
+
+    def predict_raw(self, image, original_size=None):
+        '''Decoded boxes and class scores of one image, before any threshold or NMS
+
+        original_size: as in detect_image
+        '''
+        assert not self.frozen, 'predict_raw needs the keras model, not a frozen graph'
+        if self.tflite:
+            image_data, meta = self._letterbox(image)
+            boxes, box_scores = self._decode_tflite(image_data)
+            boxes = correct_boxes(boxes, meta)
+            if original_size is not None:
+                boxes = scale_boxes(boxes, image.size, original_size)
+            return boxes, box_scores
+        if not hasattr(self, 'raw_boxes'):
+            self.raw_boxes, self.raw_box_scores = yolo_decode(self.yolo_outputs, self.anchors,
+                    len(self.class_names), self.input_image_shape)
+        image_data, meta = self._letterbox(image)
+        feed_dict = {
+            self.image_input: np.expand_dims(image_data, 0),
+            self.input_image_shape: image_data.shape[:2],
+        }
+        feed_dict.update(self._extra_feed())
+        with self.latency.time('sess_run'):
+            boxes, box_scores = self._sess_run([self.raw_boxes, self.raw_box_scores], feed_dict, 'predict_raw')
+        boxes = correct_boxes(boxes, meta)
+        if original_size is not None:
+            boxes = scale_boxes(boxes, image.size, original_size)
+        return boxes, box_scores
+
+    def _finalize(self, image, out_boxes, out_scores, out_classes,
+                  classification_cb=None, classification_cb_args=None, visualize=False, fused_classes=None,
+                  original_size=None, score=None):
+        '''Host side NMS, classification callback and optional drawing of one image
+
+        Callbacks and drawing see boxes on image, the returned boxes are scaled to original_size.
+        score: the detection score of this call, the default floor of the decayed NMS scores.
+        '''
         logging.debug('Found {} boxes for {}'.format(len(out_boxes), 'img'))
         logging.debug('applying NMS')
-        out_boxes, out_scores, out_classes = non_max_suppression_fast(out_boxes, out_scores, out_classes)
+        with self.latency.time('nms'):
+            # Boxes already scored above the detection score, only 'soft' / 'matrix' decay drops boxes here.
+            score_floor = self.nms_score if self.nms_score is not None else score if score is not None else self.score
+            keep, out_scores = nms(out_boxes, out_scores, out_classes if self.nms_class_aware else None,
+                                   iou_threshold=self.nms_iou, method=self.nms_method, score_threshold=score_floor,
+                                   top_k=self.nms_top_k)
+        image_boxes, out_classes = out_boxes[keep].astype('int'), out_classes[keep]
+        if original_size is not None and tuple(original_size) != image.size:
+            out_boxes = scale_boxes(out_boxes[keep], image.size, original_size).astype('int')
+        else:
+            out_boxes = image_boxes
+        if fused_classes is not None:
+            fused_classes = fused_classes[keep]
         logging.debug('After NMS Found {} boxes for {}'.format(len(out_boxes), 'img'))
 
         ################## TAMIR Classification CB ####################
         my_classes = ['N/A'] * len(out_boxes)
-        if classification_cb is not None:
+        if fused_classes is not None:
+            my_classes = fused_classes
+        elif classification_cb is not None:
             assert classification_cb_args is not None
-            my_classes = classification_cb(pil_image=image, boxes=out_boxes, classifier=classification_cb_args)
+            with self.latency.time('classification'):
+                my_classes = classification_cb(pil_image=image, boxes=image_boxes, classifier=classification_cb_args)
         ################################################################
 
-        end = timer()
-        logging.debug(end - start)
-
         # If not visualizing - can return here.
         if visualize is False:
             return None, out_boxes, out_scores, my_classes
         # Else - continue and returned annotated image
+        draw_start = timer()
 
         font = ImageFont.truetype(font='font/FiraMono-Medium.otf',
                     size=np.floor(3e-2 * image.size[1] + 0.5).astype('int32'))
@@ -219,13 +601,13 @@ class YOLO(object):
 
         for i, c in reversed(list(enumerate(out_classes))):
             ########## TAMIR CLASSIFICATION CB HOOK ################
-            if classification_cb:
+            if classification_cb or fused_classes is not None:
                 predicted_class = my_classes[i]
             else:
                 predicted_class = self.class_names[c]
             #########################################################
 
-            box = out_boxes[i]
+            box = image_boxes[i]
             score = out_scores[i]
 
             label = '{} {:.2f}'.format(predicted_class, score)
@@ -255,6 +637,7 @@ class YOLO(object):
             draw.text(text_origin, label, fill=(0, 0, 0), font=font)
             del draw
 
+        self.latency.record('drawing', timer() - draw_start)
         return image, out_boxes, out_scores, my_classes
 
     def close_session(self):
@@ -0,0 +1,126 @@
+"""Bus project annotation lines: PIC.JPG:[xmin1,ymin1,width1,height1,color1],..,[xminN,yminN,widthN,heightN,colorN]"""
+
+import os
+
+import numpy as np
+
+
+classes_remap = {
+    0: 1, # Green
+    1: 2, # Yellow
+    2: 3, # White
+    3: 4, # Silver/Grey
+    4: 5, # Blue
+    5: 6, # Red
+}
+
+
+def format_detections(imgname, boxes, classes, image_size, remap=False):
+    '''Return the annotation line of one image, or None if it has no boxes
+
+    boxes: [top, left, bottom, right] i.e [y1, x1, y2, x2], in image pixels
+    image_size: (width, height), boxes are clipped to it
+    '''
+    if len(boxes) == 0:
+        return None
+
+    output_line = "{}:".format(imgname)
+    for i, b in enumerate(boxes):
+        y1, x1, y2, x2 = b
+        predicted_class = classes[i]
+        if remap:
+            predicted_class = classes_remap[int(predicted_class)]
+
+        y1 = max(0, np.floor(y1 + 0.5).astype('int32'))
+        x1 = max(0, np.floor(x1 + 0.5).astype('int32'))
+        y2 = min(image_size[1], np.floor(y2 + 0.5).astype('int32'))
+        x2 = min(image_size[0], np.floor(x2 + 0.5).astype('int32'))
+
+        output_line += "[{},{},{},{},{}]".format(x1, y1, x2 - x1, y2 - y1, predicted_class)
+        if i < (len(boxes) - 1):
+            output_line += ','
+        else:
+            output_line += '\n'
+    return output_line
+
+
+def read_completed(path):
+    '''Return the set of image names completed in an AnnotationWriter output'''
+    completed = set()
+    for p in (path, path + '.done'):
+        if os.path.exists(p):
+            with open(p) as f:
+                for line in f:
+                    if line.endswith('\n'):
+                        completed.add(line.split(':', 1)[0].rstrip('\n'))
+    return completed
+
+
+class AnnotationWriter(object):
+    '''Append-only writer of annotation lines with a manifest of completed images
+
+    Every image passed to add() is completed: its line (if it has boxes) is in path and its name
+    in the path + '.done' manifest. Lines and names are written every flush_every images, the
+    lines first, so a crash loses at most that many images and never leaves an image half done.
+    resume: keep the existing output and skip its completed images, else start from scratch
+    '''
+
+    def __init__(self, path, resume=False, flush_every=32):
+        self.path = path
+        self.manifest_path = path + '.done'
+        self.flush_every = flush_every
+        if resume:
+            self.completed = read_completed(path)
+            _drop_partial_line(path)
+            _drop_partial_line(self.manifest_path)
+        else:
+            self.completed = set()
+        mode = 'a' if resume else 'w'
+        self.out_file = open(path, mode)
+        self.manifest_file = open(self.manifest_path, mode)
+        self.lines = []
+        self.names = []
+
+    def __contains__(self, imgname):
+        return imgname in self.completed
+
+    def add(self, imgname, line):
+        '''line: format_detections output of imgname, None if it has no boxes'''
+        if line is not None:
+            self.lines.append(line)
+        self.names.append(imgname)
+        self.completed.add(imgname)
+        if len(self.names) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.names:
+            return
+        self.out_file.writelines(self.lines)
+        self.out_file.flush()
+        os.fsync(self.out_file.fileno())
+        self.manifest_file.writelines(name + '\n' for name in self.names)
+        self.manifest_file.flush()
+        self.lines = []
+        self.names = []
+
+    def close(self):
+        self.flush()
+        self.out_file.close()
+        self.manifest_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _drop_partial_line(path):
+    '''Truncate an unterminated last line, left behind by a crash during a write'''
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
@@ -0,0 +1,85 @@
+"""On disk cache of decoded, pre-NMS YOLO predictions.
+
+A cache directory holds
+    meta.json   - num_classes and the score floor used when writing
+    boxes.f32   - float32 rows of y_min, x_min, y_max, x_max (image pixels)
+    scores.f16  - float16 rows of num_classes class scores
+    index.txt   - one tab separated line per image: name, first row, rows, width, height
+"""
+
+import json
+import os
+
+import numpy as np
+
+
+class PredictionCacheWriter(object):
+    '''Append per image outputs of yolo3.model.yolo_decode to a cache directory'''
+
+    def __init__(self, path, num_classes, min_score=0.01):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.num_classes = num_classes
+        # Rows whose best class score is below min_score can not pass any useful threshold.
+        self.min_score = min_score
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'num_classes': num_classes, 'min_score': min_score}, f)
+        self.boxes_file = open(os.path.join(path, 'boxes.f32'), 'wb')
+        self.scores_file = open(os.path.join(path, 'scores.f16'), 'wb')
+        self.index_file = open(os.path.join(path, 'index.txt'), 'w')
+        self.offset = 0
+
+    def add(self, name, image_size, boxes, box_scores):
+        '''image_size is (width, height) of the image the boxes refer to'''
+        keep = box_scores.max(axis=1) >= self.min_score
+        boxes = np.ascontiguousarray(boxes[keep], dtype='float32')
+        box_scores = np.ascontiguousarray(box_scores[keep], dtype='float16')
+        self.boxes_file.write(boxes.tobytes())
+        self.scores_file.write(box_scores.tobytes())
+        self.index_file.write('{}\t{}\t{}\t{}\t{}\n'.format(name, self.offset, len(boxes), *image_size))
+        self.offset += len(boxes)
+
+    def close(self):
+        for f in (self.boxes_file, self.scores_file, self.index_file):
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PredictionCache(object):
+    '''Memory mapped reader of a cache written by PredictionCacheWriter'''
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.num_classes = meta['num_classes']
+        self.min_score = meta['min_score']
+
+        self.index = []
+        with open(os.path.join(path, 'index.txt')) as f:
+            for line in f:
+                name, offset, count, width, height = line.rstrip('\n').rsplit('\t', 4)
+                self.index.append((name, int(offset), int(count), (int(width), int(height))))
+
+        num_rows = sum(count for _, _, count, _ in self.index)
+        if num_rows == 0:
+            self.boxes = np.zeros((0, 4), dtype='float32')
+            self.scores = np.zeros((0, self.num_classes), dtype='float16')
+        else:
+            self.boxes = np.memmap(os.path.join(path, 'boxes.f32'), dtype='float32', mode='r',
+                                   shape=(num_rows, 4))
+            self.scores = np.memmap(os.path.join(path, 'scores.f16'), dtype='float16', mode='r',
+                                    shape=(num_rows, self.num_classes))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        '''Yield name, image_size, boxes, box_scores (float32) per image'''
+        for name, offset, count, image_size in self.index:
+            yield (name, image_size, np.asarray(self.boxes[offset:offset + count]),
+                   self.scores[offset:offset + count].astype('float32'))
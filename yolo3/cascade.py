@@ -0,0 +1,70 @@
+"""Escalation policy and statistics of the YOLO detection cascades."""
+
+from collections import Counter
+
+import numpy as np
+
+
+class CascadePolicy(object):
+    '''Decide whether the detections of a cascade stage are settled or go to the next stage
+
+    score_band: (low, high), escalate when the best score is in [low, high)
+    escalate_empty: escalate when the stage found no box
+    max_count: escalate when the stage found more boxes than this (crowded scene)
+    min_box_size: escalate when a box side is below this fraction of the image side (small objects)
+    '''
+
+    def __init__(self, score_band=(0.3, 0.6), escalate_empty=True, max_count=None, min_box_size=None):
+        self.score_band = score_band
+        self.escalate_empty = escalate_empty
+        self.max_count = max_count
+        self.min_box_size = min_box_size
+
+    def escalate(self, boxes, scores, image_size):
+        '''Return why the image needs the next stage ('empty', 'score', 'count', 'size'), None if settled
+
+        boxes: y_min, x_min, y_max, x_max in image pixels
+        image_size: (w, h)
+        '''
+        if len(scores) == 0:
+            return 'empty' if self.escalate_empty else None
+        low, high = self.score_band
+        if low <= np.max(scores) < high:
+            return 'score'
+        if self.max_count is not None and len(scores) > self.max_count:
+            return 'count'
+        if self.min_box_size is not None:
+            w, h = image_size
+            sides = np.minimum((boxes[:, 2] - boxes[:, 0]) / h, (boxes[:, 3] - boxes[:, 1]) / w)
+            if sides.min() < self.min_box_size:
+                return 'size'
+        return None
+
+
+class CascadeStats(object):
+    '''Count the stage every image ended at and why images were escalated'''
+
+    def __init__(self, stage_names):
+        self.stage_names = list(stage_names)
+        self.final = Counter()
+        self.reasons = Counter()
+
+    def record(self, stage_name, reasons):
+        self.final[stage_name] += 1
+        self.reasons.update(reasons)
+
+    @property
+    def images(self):
+        return sum(self.final.values())
+
+    def escalation_rate(self):
+        '''Fraction of the images that needed more than the first stage'''
+        if not self.images:
+            return 0.
+        return 1. - self.final[self.stage_names[0]] / float(self.images)
+
+    def summary(self):
+        stages = ', '.join('{} {}'.format(name, self.final[name]) for name in self.stage_names)
+        reasons = ', '.join('{} {}'.format(reason, n) for reason, n in sorted(self.reasons.items()))
+        return 'cascade: {} images, ended at {}; escalated {:.1%} ({})'.format(
+            self.images, stages, self.escalation_rate(), reasons or 'none')
@@ -0,0 +1,85 @@
+"""Inference time simplification of the YOLO keras models."""
+
+from collections import Counter
+
+import numpy as np
+from keras.models import Model
+
+
+def fold_batch_norm(model):
+    '''Return an equivalent model with every Conv2D -> BatchNormalization pair folded into the Conv2D
+
+    A BatchNormalization is folded when its only input is a Conv2D whose only consumer it is,
+    as in DarknetConv2D_BN_Leaky. The conv gets a bias, the normalization layer is dropped:
+        kernel' = kernel * gamma / sqrt(var + eps)
+        bias'   = (bias - mean) * gamma / sqrt(var + eps) + beta
+    The folded model only matches the original in inference mode (moving statistics).
+    '''
+    config = model.get_config()
+    layers = {layer['name']: layer for layer in config['layers']}
+    consumers = Counter(inbound[0] for layer in config['layers']
+                        for node in layer['inbound_nodes'] for inbound in node)
+
+    folds = {}  # batch norm name -> conv name
+    for layer in config['layers']:
+        if layer['class_name'] != 'BatchNormalization' or layer['config']['axis'] not in (-1, 3):
+            continue
+        if len(layer['inbound_nodes']) != 1 or len(layer['inbound_nodes'][0]) != 1:
+            continue
+        conv_name = layer['inbound_nodes'][0][0][0]
+        conv = layers[conv_name]
+        if conv['class_name'] == 'Conv2D' and len(conv['inbound_nodes']) == 1 and consumers[conv_name] == 1:
+            folds[layer['name']] = conv_name
+
+    def rewire(inbound):
+        # [layer name, node index, tensor index(, kwargs)], a folded conv has a single node.
+        if inbound[0] in folds:
+            return [folds[inbound[0]], 0] + list(inbound[2:])
+        return inbound
+
+    config['layers'] = [layer for layer in config['layers'] if layer['name'] not in folds]
+    for layer in config['layers']:
+        layer['inbound_nodes'] = [[rewire(inbound) for inbound in node] for node in layer['inbound_nodes']]
+        if layer['name'] in folds.values():
+            layer['config']['use_bias'] = True
+    config['output_layers'] = [rewire(output) for output in config['output_layers']]
+    folded = Model.from_config(config)
+
+    folded_by = {conv_name: bn_name for bn_name, conv_name in folds.items()}
+    for layer in folded.layers:
+        source = model.get_layer(layer.name)
+        if layer.name not in folded_by:
+            layer.set_weights(source.get_weights())
+            continue
+        weights = source.get_weights()
+        kernel = weights[0]
+        bias = weights[1] if source.use_bias else np.zeros(kernel.shape[-1], dtype=kernel.dtype)
+        gamma, beta, mean, variance, epsilon = _batch_norm_params(model.get_layer(folded_by[layer.name]))
+        scale = gamma / np.sqrt(variance + epsilon)
+        layer.set_weights([kernel * scale, (bias - mean) * scale + beta])
+
+    print('folded {} batch norms, {} -> {} layers'.format(len(folds), len(model.layers), len(folded.layers)))
+    return folded
+
+
+def _batch_norm_params(layer):
+    weights = list(layer.get_weights())
+    gamma = weights.pop(0) if layer.scale else 1.
+    beta = weights.pop(0) if layer.center else 0.
+    mean, variance = weights
+    return gamma, beta, mean, variance, layer.epsilon
+
+
+def check_folding(model, folded, input_shape=(416, 416, 3), batch_size=2, seed=0):
+    '''Run model and folded on the same random images, return the max abs difference of every output
+
+    Also returns the max abs value of every original output, to judge the difference against.
+    '''
+    images = np.random.RandomState(seed).uniform(0., 1., (batch_size, ) + tuple(input_shape)).astype('float32')
+    expected = model.predict(images)
+    actual = folded.predict(images)
+    if not isinstance(expected, list):
+        expected, actual = [expected], [actual]
+    diffs = [float(np.abs(e - a).max()) for e, a in zip(expected, actual)]
+    scales = [float(np.abs(e).max()) for e in expected]
+    return diffs, scales
@@ -0,0 +1,162 @@
+"""Per-layer parameters, FLOPs, activation memory and CPU latency of the keras models."""
+
+import re
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+import numpy as np
+from keras import backend as K
+from keras.models import Model
+
+
+def static_model(model, input_shape):
+    '''Copy of model (fresh weights) with a static (h, w, c) input, so every layer has a static shape'''
+    config = model.get_config()
+    for layer in config['layers']:
+        if layer['class_name'] == 'InputLayer':
+            layer['config']['batch_input_shape'] = (None, ) + tuple(input_shape)
+    return Model.from_config(config)
+
+
+def layer_groups(model):
+    '''{layer name: group}, backbone stages then one group per output head
+
+    classification_models resnets: stem, stage1..stage4 by layer name, top after the last stage.
+    yolo_body / tiny_yolo_body: the backbone ends at the last layer every output depends on
+    (the last Add for darknet). It is split into stem, resblock1..5 at each resblock_body
+    ZeroPadding2D (tiny: stage1.. at each MaxPooling2D). Any other layer goes to head1.. of
+    the first output it feeds.
+    '''
+    names = [layer.name for layer in model.layers]
+    stages = [re.match(r'(stage\d+)_unit', name) for name in names]
+    if any(stages):
+        last = max(i for i, stage in enumerate(stages) if stage)
+        groups, current = {}, 'stem'
+        for i, (name, stage) in enumerate(zip(names, stages)):
+            current = stage.group(1) if stage else current
+            groups[name] = 'top' if i > last else current
+        return groups
+
+    config = model.get_config()
+    parents = {layer['name']: set(inbound[0] for node in layer['inbound_nodes'] for inbound in node)
+               for layer in config['layers']}
+    heads = [_ancestors(output[0], parents) for output in config['output_layers']]
+    common = set.intersection(*heads)
+    adds = [layer.name for layer in model.layers if layer.__class__.__name__ == 'Add' and layer.name in common]
+    backbone = _ancestors(adds[-1], parents) if adds else common
+    marker = 'ZeroPadding2D' if adds else 'MaxPooling2D'
+    prefix = 'resblock' if adds else 'stage'
+
+    groups, stage = {}, 0
+    for layer in model.layers:  # sorted by depth
+        if layer.name in backbone:
+            stage += layer.__class__.__name__ == marker
+            groups[layer.name] = '{}{}'.format(prefix, stage) if stage else 'stem'
+        else:
+            head = next(i for i, ancestors in enumerate(heads) if layer.name in ancestors)
+            groups[layer.name] = 'head{}'.format(head + 1)
+    return groups
+
+
+def _ancestors(name, parents):
+    ancestors, stack = set(), [name]
+    while stack:
+        name = stack.pop()
+        if name not in ancestors:
+            ancestors.add(name)
+            stack.extend(parents[name])
+    return ancestors
+
+
+def _shapes(shape):
+    return shape if isinstance(shape, list) else [shape]
+
+
+def layer_flops(layer):
+    '''Floating point operations (a multiply-add counts 2) of one layer on a batch of one'''
+    kind = layer.__class__.__name__
+    input_shapes, output_shape = _shapes(layer.input_shape), layer.output_shape
+    out = int(np.prod(output_shape[1:]))
+    if kind in ('Conv2D', 'DepthwiseConv2D'):
+        kh, kw = layer.kernel_size
+        fan_in = kh * kw * (1 if kind == 'DepthwiseConv2D' else input_shapes[0][-1])
+        return 2 * out * fan_in + (out if layer.use_bias else 0)
+    if kind == 'Dense':
+        return 2 * out * input_shapes[0][-1] + (out if layer.use_bias else 0)
+    if kind == 'BatchNormalization':
+        return 2 * out
+    if kind in ('LeakyReLU', 'Activation', 'ReLU'):
+        return out
+    if kind in ('Add', 'Multiply', 'Subtract', 'Average', 'Maximum'):
+        return out * (len(input_shapes) - 1)
+    if kind in ('MaxPooling2D', 'AveragePooling2D'):
+        return out * int(np.prod(layer.pool_size))
+    if kind in ('GlobalAveragePooling2D', 'GlobalMaxPooling2D'):
+        return int(np.prod(input_shapes[0][1:]))
+    return 0  # Input, ZeroPadding2D, UpSampling2D, Concatenate, ... only move data
+
+
+def layer_latency(layer, repeat=10, seed=0):
+    '''Median seconds of one sess.run of layer alone, its inputs fed with random values
+
+    The cost of a sess.run computing nothing is measured the same way and subtracted.
+    '''
+    inputs = layer.input if isinstance(layer.input, list) else [layer.input]
+    rng = np.random.RandomState(seed)
+    feed_dict = {x: rng.uniform(-1., 1., shape).astype('float32')
+                 for x, shape in zip(inputs, _shapes(layer.input_shape))}
+    if not isinstance(K.learning_phase(), int):
+        feed_dict[K.learning_phase()] = 0
+    sess = K.get_session()
+    return max(0., _median_run(sess, layer.output, feed_dict, repeat) - _median_run(sess, [], feed_dict, repeat))
+
+
+def _median_run(sess, fetches, feed_dict, repeat):
+    sess.run(fetches, feed_dict=feed_dict)
+    times = []
+    for _ in range(repeat):
+        start = timer()
+        sess.run(fetches, feed_dict=feed_dict)
+        times.append(timer() - start)
+    return float(np.median(times))
+
+
+def profile_model(model, input_shape, repeat=10, latency=True):
+    '''Per-layer profile of model at a static (h, w, c) input_shape, batch of one
+
+    Returns (layers, groups, total): layers is a list of dicts (name, type, group, output_shape,
+    params, flops, activation_bytes, latency_s), groups an OrderedDict of their per group sums,
+    total the sums over the model with the end to end latency_s.
+    Latencies are measured on fresh random weights, which does not change the cost of a layer.
+    '''
+    model = static_model(model, input_shape)
+    groups = layer_groups(model)
+    layers = []
+    for layer in model.layers:
+        layers.append({
+            'name': layer.name,
+            'type': layer.__class__.__name__,
+            'group': groups[layer.name],
+            'output_shape': [list(shape[1:]) for shape in _shapes(layer.output_shape)],
+            'params': int(layer.count_params()),
+            'flops': int(layer_flops(layer)),
+            # float32 outputs, all alive at once when nothing is freed (the worst case)
+            'activation_bytes': int(sum(4 * np.prod(shape[1:]) for shape in _shapes(layer.output_shape))),
+            'latency_s': layer_latency(layer, repeat) if latency and layer.__class__.__name__ != 'InputLayer' else 0.,
+        })
+
+    keys = ('params', 'flops', 'activation_bytes', 'latency_s')
+    group_totals = OrderedDict()
+    for layer in layers:
+        totals = group_totals.setdefault(layer['group'], dict.fromkeys(keys, 0))
+        for key in keys:
+            totals[key] += layer[key]
+    total = {key: sum(layer[key] for layer in layers) for key in keys}
+    if latency:
+        image = np.random.RandomState(0).uniform(0., 1., (1, ) + tuple(input_shape)).astype('float32')
+        model.predict(image)
+        start = timer()
+        for _ in range(repeat):
+            model.predict(image)
+        total['end_to_end_latency_s'] = (timer() - start) / repeat
+    return layers, group_totals, total
@@ -5,10 +5,10 @@ from functools import wraps
 import numpy as np
 import tensorflow as tf
 from keras import backend as K
-from keras.layers import Conv2D, Add, ZeroPadding2D, UpSampling2D, Concatenate, MaxPooling2D
+from keras.layers import Conv2D, Add, ZeroPadding2D, UpSampling2D, Concatenate, MaxPooling2D, Input
 from keras.layers.advanced_activations import LeakyReLU
 from keras.layers.normalization import BatchNormalization
-from keras.models import Model
+from keras.models import Model, load_model
 from keras.regularizers import l2
 
 from yolo3.utils import compose
@@ -118,6 +118,21 @@ def tiny_yolo_body(inputs, num_anchors, num_classes):
 
     return Model(inputs, [y1,y2])
 
+def load_yolo_model(model_path, num_anchors, num_classes):
+    '''Load a saved model, or construct the body for num_anchors and load weights into it'''
+    is_tiny_version = num_anchors==6 # default setting
+    try:
+        model = load_model(model_path, compile=False)
+    except:
+        model = tiny_yolo_body(Input(shape=(None,None,3)), num_anchors//2, num_classes) \
+            if is_tiny_version else yolo_body(Input(shape=(None,None,3)), num_anchors//3, num_classes)
+        model.load_weights(model_path) # make sure model, anchors and classes match
+    else:
+        assert model.layers[-1].output_shape[-1] == \
+            num_anchors/len(model.output) * (num_classes + 5), \
+            'Mismatch between model and given anchor and class sizes'
+    return model
+
 
 def yolo_head(feats, anchors, num_classes, input_shape, calc_loss=False):
     """Convert final layer features to bounding box parameters."""
@@ -125,13 +140,20 @@ def yolo_head(feats, anchors, num_classes, input_shape, calc_loss=False):
     # Reshape to batch, height, width, num_anchors, box_params.
     anchors_tensor = K.reshape(K.constant(anchors), [1, 1, 1, num_anchors, 2])
 
-    grid_shape = K.shape(feats)[1:3] # height, width
-    grid_y = K.tile(K.reshape(K.arange(0, stop=grid_shape[0]), [-1, 1, 1, 1]),
-        [1, grid_shape[1], 1, 1])
-    grid_x = K.tile(K.reshape(K.arange(0, stop=grid_shape[1]), [1, -1, 1, 1]),
-        [grid_shape[0], 1, 1, 1])
-    grid = K.concatenate([grid_x, grid_y])
-    grid = K.cast(grid, K.dtype(feats))
+    grid_shape = K.int_shape(feats)[1:3] # height, width
+    if None not in grid_shape:
+        # Static input size (e.g. a frozen export), the grid is a plain constant.
+        grid_y, grid_x = np.meshgrid(np.arange(grid_shape[0]), np.arange(grid_shape[1]), indexing='ij')
+        grid = np.stack([grid_x, grid_y], axis=-1).reshape(grid_shape[0], grid_shape[1], 1, 2)
+        grid = K.constant(grid, dtype=K.dtype(feats))
+    else:
+        grid_shape = K.shape(feats)[1:3] # height, width
+        grid_y = K.tile(K.reshape(K.arange(0, stop=grid_shape[0]), [-1, 1, 1, 1]),
+            [1, grid_shape[1], 1, 1])
+        grid_x = K.tile(K.reshape(K.arange(0, stop=grid_shape[1]), [1, -1, 1, 1]),
+            [grid_shape[0], 1, 1, 1])
+        grid = K.concatenate([grid_x, grid_y])
+        grid = K.cast(grid, K.dtype(feats))
 
     feats = K.reshape(
         feats, [-1, grid_shape[0], grid_shape[1], num_anchors, num_classes + 5])
@@ -184,17 +206,15 @@ def yolo_boxes_and_scores(feats, anchors, num_classes, input_shape, image_shape)
     return boxes, box_scores
 
 
-def yolo_eval(yolo_outputs,
-              anchors,
-              num_classes,
-              image_shape,
-              max_boxes=20,
-              score_threshold=.6,
-              iou_threshold=.6):
-    """Evaluate YOLO model on given input and return filtered boxes."""
+def yolo_decode(yolo_outputs, anchors, num_classes, image_shape):
+    '''Decode all output layers to boxes (y_min, x_min, y_max, x_max) and class scores, before NMS'''
     num_layers = len(yolo_outputs)
     anchor_mask = [[6,7,8], [3,4,5], [0,1,2]] if num_layers==3 else [[3,4,5], [1,2,3]] # default setting
-    input_shape = K.shape(yolo_outputs[0])[1:3] * 32
+    grid_shape = K.int_shape(yolo_outputs[0])[1:3]
+    if None not in grid_shape:
+        input_shape = K.constant([grid_shape[0] * 32, grid_shape[1] * 32], dtype='int32')
+    else:
+        input_shape = K.shape(yolo_outputs[0])[1:3] * 32
     boxes = []
     box_scores = []
     for l in range(num_layers):
@@ -204,9 +224,37 @@ def yolo_eval(yolo_outputs,
         box_scores.append(_box_scores)
     boxes = K.concatenate(boxes, axis=0)
     box_scores = K.concatenate(box_scores, axis=0)
+    return boxes, box_scores
+
+
+def yolo_eval(yolo_outputs,
+              anchors,
+              num_classes,
+              image_shape,
+              max_boxes=20,
+              score_threshold=.6,
+              iou_threshold=.6,
+              nms_mode='per_class'):
+    """Evaluate YOLO model on given input and return filtered boxes.
+
+    nms_mode selects how NMS is laid out in the graph:
+    'per_class' - one boolean_mask / non_max_suppression / gather chain per class,
+    'batched' - a single non_max_suppression over class offset boxes,
+    'combined' - a single tf.image.combined_non_max_suppression op (TF >= 1.15).
+    The graph size of 'batched' and 'combined' does not depend on num_classes.
+    max_boxes, score_threshold and iou_threshold may be scalar tensors (e.g. placeholders).
+    """
+    boxes, box_scores = yolo_decode(yolo_outputs, anchors, num_classes, image_shape)
+
+    if nms_mode == 'batched':
+        return batched_nms(boxes, box_scores, max_boxes, score_threshold, iou_threshold)
+    if nms_mode == 'combined':
+        return combined_nms(boxes, box_scores, num_classes, max_boxes, score_threshold, iou_threshold)
+    if nms_mode != 'per_class':
+        raise ValueError('Unknown nms_mode: {}'.format(nms_mode))
 
     mask = box_scores >= score_threshold
-    max_boxes_tensor = K.constant(max_boxes, dtype='int32')
+    max_boxes_tensor = K.cast(max_boxes, 'int32')
     boxes_ = []
     scores_ = []
     classes_ = []
@@ -229,6 +277,42 @@ def yolo_eval(yolo_outputs,
     return boxes_, scores_, classes_
 
 
+def batched_nms(boxes, box_scores, max_boxes=20, score_threshold=.6, iou_threshold=.6):
+    '''Class aware NMS with a single non_max_suppression op
+
+    Every (box, class) pair above score_threshold becomes a candidate, and the
+    candidates are shifted apart by class so boxes of different classes never
+    overlap. At most max_boxes * num_classes boxes are returned overall
+    (per_class mode caps each class at max_boxes instead).
+    '''
+    num_classes = K.shape(box_scores)[1]
+    candidates = tf.where(box_scores >= score_threshold)
+    class_boxes = K.gather(boxes, candidates[:, 0])
+    class_box_scores = tf.gather_nd(box_scores, candidates)
+    classes = K.cast(candidates[:, 1], 'int32')
+
+    span = K.max(boxes) - K.min(boxes) + 1.
+    offset_boxes = class_boxes + K.expand_dims(K.cast(classes, K.dtype(boxes)) * span, -1)
+    nms_index = tf.image.non_max_suppression(
+        offset_boxes, class_box_scores, max_boxes * num_classes, iou_threshold=iou_threshold)
+
+    return K.gather(class_boxes, nms_index), K.gather(class_box_scores, nms_index), K.gather(classes, nms_index)
+
+
+def combined_nms(boxes, box_scores, num_classes, max_boxes=20, score_threshold=.6, iou_threshold=.6):
+    '''Class aware NMS with tf.image.combined_non_max_suppression (TF >= 1.15)
+
+    The boxes are in pixels, so they must not be clipped to [0, 1]. TF 1.14 has the op
+    but always clips, clip_boxes=False needs 1.15.
+    '''
+    nmsed_boxes, nmsed_scores, nmsed_classes, valid_detections = tf.image.combined_non_max_suppression(
+        K.expand_dims(K.expand_dims(boxes, 0), 2), K.expand_dims(box_scores, 0),
+        max_output_size_per_class=max_boxes, max_total_size=max_boxes * num_classes,
+        iou_threshold=iou_threshold, score_threshold=score_threshold, clip_boxes=False)
+    valid = valid_detections[0]
+    return nmsed_boxes[0, :valid], nmsed_scores[0, :valid], K.cast(nmsed_classes[0, :valid], 'int32')
+
+
 def preprocess_true_boxes(true_boxes, input_shape, anchors, num_classes):
     '''Preprocess true boxes to training input format
 
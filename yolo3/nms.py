@@ -0,0 +1,296 @@
+"""Non max suppression on numpy arrays."""
+
+import numpy as np
+
+
+# Malisiewicz et al.
+def non_max_suppression_fast(boxes, scores, classes, overlapThresh=0.3):
+    # if there are no boxes, return an empty list
+    if len(boxes) == 0:
+        return []
+
+    # if the bounding boxes integers, convert them to floats --
+    # this is important since we'll be doing a bunch of divisions
+    if boxes.dtype.kind == "i":
+        boxes = boxes.astype("float")
+
+    # initialize the list of picked indexes
+    pick = []
+
+    # grab the coordinates of the bounding boxes
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = boxes[:, 3]
+    y2 = boxes[:, 2]
+
+    # compute the area of the bounding boxes and sort the bounding
+    # boxes by the bottom-right y-coordinate of the bounding box
+    area = (x2 - x1 + 1) * (y2 - y1 + 1)
+    idxs = np.argsort(y2)
+
+    # keep looping while some indexes still remain in the indexes
+    # list
+    while len(idxs) > 0:
+        # grab the last index in the indexes list and add the
+        # index value to the list of picked indexes
+        last = len(idxs) - 1
+        i = idxs[last]
+        pick.append(i)
+
+        # find the largest (x, y) coordinates for the start of
+        # the bounding box and the smallest (x, y) coordinates
+        # for the end of the bounding box
+        xx1 = np.maximum(x1[i], x1[idxs[:last]])
+        yy1 = np.maximum(y1[i], y1[idxs[:last]])
+        xx2 = np.minimum(x2[i], x2[idxs[:last]])
+        yy2 = np.minimum(y2[i], y2[idxs[:last]])
+
+        # compute the width and height of the bounding box
+        w = np.maximum(0, xx2 - xx1 + 1)
+        h = np.maximum(0, yy2 - yy1 + 1)
+
+        # compute the ratio of overlap
+        overlap = (w * h) / area[idxs[:last]]
+
+        # delete all indexes from the index list that have
+        idxs = np.delete(idxs, np.concatenate(([last],
+                                               np.where(overlap > overlapThresh)[0])))
+
+    # return only the bounding boxes that were picked using the
+    # integer data type
+    return boxes[pick].astype("int"), scores[pick], classes[pick]
+
+
+def box_iou_matrix(boxes):
+    '''Return pairwise iou matrix
+
+    Parameters
+    ----------
+    boxes: array, shape=(n, 4), y_min, x_min, y_max, x_max
+
+    Returns
+    -------
+    iou: array, shape=(n, n)
+
+    '''
+    y_min, x_min, y_max, x_max = np.asarray(boxes, dtype='float32').T
+    area = (y_max - y_min) * (x_max - x_min)
+    intersect_h = np.minimum(y_max[:, None], y_max[None, :]) - np.maximum(y_min[:, None], y_min[None, :])
+    intersect_w = np.minimum(x_max[:, None], x_max[None, :]) - np.maximum(x_min[:, None], x_min[None, :])
+    intersect_area = np.maximum(intersect_h, 0.) * np.maximum(intersect_w, 0.)
+    union = area[:, None] + area[None, :] - intersect_area
+    return intersect_area / np.maximum(union, 1e-9)
+
+
+def box_iou(box, boxes):
+    '''Return the iou of box with each of boxes (y_min, x_min, y_max, x_max)'''
+    y_min, x_min, y_max, x_max = boxes.T
+    intersect_h = np.minimum(box[2], y_max) - np.maximum(box[0], y_min)
+    intersect_w = np.minimum(box[3], x_max) - np.maximum(box[1], x_min)
+    intersect_area = np.maximum(intersect_h, 0.) * np.maximum(intersect_w, 0.)
+    area = (y_max - y_min) * (x_max - x_min)
+    box_area = (box[2] - box[0]) * (box[3] - box[1])
+    return intersect_area / np.maximum(box_area + area - intersect_area, 1e-9)
+
+
+def nms(boxes, scores, classes=None, iou_threshold=0.5, method='greedy',
+        score_threshold=0., top_k=None, max_boxes=None, sigma=0.5):
+    '''Vectorized non max suppression
+
+    Parameters
+    ----------
+    boxes: array, shape=(n, 4), y_min, x_min, y_max, x_max
+    scores: array, shape=(n,)
+    classes: array, shape=(n,), optional. When given, boxes of different classes
+        never suppress each other (boxes are shifted apart by a per class offset).
+    iou_threshold: float, overlap above which a box is suppressed ('greedy')
+    method: 'greedy' hard suppression, 'soft' gaussian Soft-NMS or
+        'matrix' Matrix NMS (parallel gaussian decay, SOLOv2)
+    score_threshold: float, boxes scoring below it (after decay) are dropped
+    top_k: integer, only the top_k highest scoring boxes are considered. 'greedy' and 'soft'
+        compute one row of ious per kept box, 'matrix' the full n x n matrix, so dense
+        scenes need it to stay fast.
+    max_boxes: integer, maximal number of returned boxes
+    sigma: float, gaussian decay parameter of 'soft' and 'matrix'
+
+    Returns
+    -------
+    keep: array of indices into boxes, sorted by descending (decayed) score
+    scores: array, the (decayed) scores of the kept boxes
+
+    '''
+    scores = np.asarray(scores, dtype='float32')
+    order = np.argsort(-scores, kind='stable')
+    order = order[scores[order] >= score_threshold]
+    if top_k is not None:
+        order = order[:top_k]
+    if len(order) == 0:
+        return np.zeros((0,), dtype='int64'), np.zeros((0,), dtype='float32')
+
+    sorted_boxes = np.asarray(boxes, dtype='float32')[order]
+    sorted_scores = scores[order]
+    if classes is not None:
+        # Shift every class to its own region so that cross class iou is 0.
+        offset = sorted_boxes.max() - min(sorted_boxes.min(), 0.) + 1.
+        sorted_boxes = sorted_boxes + (np.asarray(classes)[order] * offset)[:, None].astype('float32')
+
+    if method == 'greedy':
+        keep = _greedy(sorted_boxes, iou_threshold, max_boxes)
+        kept_scores = sorted_scores[keep]
+    elif method == 'soft':
+        keep, kept_scores = _soft(sorted_boxes, sorted_scores, sigma, score_threshold)
+    elif method == 'matrix':
+        keep, kept_scores = _matrix(box_iou_matrix(sorted_boxes), sorted_scores, sigma, score_threshold)
+    else:
+        raise ValueError('Unknown nms method: {}'.format(method))
+
+    if max_boxes is not None:
+        keep, kept_scores = keep[:max_boxes], kept_scores[:max_boxes]
+    return order[keep], kept_scores
+
+
+def _greedy(boxes, iou_threshold, max_boxes=None):
+    '''Hard nms on score sorted boxes, returns kept positions
+
+    Up to 128 boxes one iou matrix is cheapest, above it one row of ious per kept box.
+    '''
+    if len(boxes) <= 128:
+        iou = box_iou_matrix(boxes)
+        suppressed = np.zeros(len(boxes), dtype=bool)
+        keep = []
+        for i in range(len(boxes)):
+            if suppressed[i]:
+                continue
+            keep.append(i)
+            if len(keep) == max_boxes:
+                break
+            suppressed[i + 1:] |= iou[i, i + 1:] > iou_threshold
+        return np.array(keep, dtype='int64')
+
+    remaining = np.arange(len(boxes))
+    keep = []
+    while len(remaining) > 0 and (max_boxes is None or len(keep) < max_boxes):
+        i, remaining = remaining[0], remaining[1:]
+        keep.append(i)
+        remaining = remaining[box_iou(boxes[i], boxes[remaining]) <= iou_threshold]
+    return np.array(keep, dtype='int64')
+
+
+def _soft(boxes, scores, sigma, score_threshold):
+    '''Gaussian Soft-NMS on score sorted boxes'''
+    scores = scores.copy()
+    remaining = np.arange(len(scores))
+    keep = []
+    while len(remaining) > 0:
+        best = remaining[np.argmax(scores[remaining])]
+        keep.append(best)
+        remaining = remaining[remaining != best]
+        scores[remaining] *= np.exp(-(box_iou(boxes[best], boxes[remaining]) ** 2) / sigma)
+        remaining = remaining[scores[remaining] >= score_threshold]
+    keep = np.array(keep, dtype='int64')
+    return keep, scores[keep]
+
+
+def _matrix(iou, scores, sigma, score_threshold):
+    '''Matrix NMS on a score sorted iou matrix'''
+    # Only overlaps with higher scoring boxes decay a box.
+    iou = np.triu(iou, k=1)
+    # For each suppressor, its own max overlap with a higher scoring box.
+    iou_cmax = iou.max(axis=0)
+    decay = np.exp(-(iou ** 2 - iou_cmax[:, None] ** 2) / sigma).min(axis=0)
+    decayed = scores * decay
+    keep = np.argsort(-decayed, kind='stable')
+    keep = keep[decayed[keep] >= score_threshold]
+    return keep, decayed[keep]
+
+
+def per_class_nms(boxes, box_scores, score_threshold=.6, iou_threshold=.6, max_boxes=20):
+    '''Numpy counterpart of the per_class NMS of yolo3.model.yolo_eval
+
+    Parameters
+    ----------
+    boxes: array, shape=(n, 4), decoded boxes (yolo3.model.yolo_decode)
+    box_scores: array, shape=(n, num_classes)
+
+    Returns
+    -------
+    index: array, row of boxes of every kept box
+    scores: array, score of every kept box
+    classes: array, class of every kept box
+
+    '''
+    index_, scores_, classes_ = [], [], []
+    for c in range(box_scores.shape[1]):
+        rows = np.flatnonzero(box_scores[:, c] >= score_threshold)
+        keep, class_scores = nms(boxes[rows], box_scores[rows, c],
+                                 iou_threshold=iou_threshold, max_boxes=max_boxes)
+        index_.append(rows[keep])
+        scores_.append(class_scores)
+        classes_.append(np.full(len(keep), c, dtype='int32'))
+    return np.concatenate(index_), np.concatenate(scores_), np.concatenate(classes_)
+
+
+def box_ios(box, boxes):
+    '''Intersection of box with each of boxes over the smaller of the two areas'''
+    y_min, x_min, y_max, x_max = np.asarray(boxes, dtype='float32').T
+    intersect_h = np.minimum(box[2], y_max) - np.maximum(box[0], y_min)
+    intersect_w = np.minimum(box[3], x_max) - np.maximum(box[1], x_min)
+    intersect_area = np.maximum(intersect_h, 0.) * np.maximum(intersect_w, 0.)
+    area = (y_max - y_min) * (x_max - x_min)
+    box_area = (box[2] - box[0]) * (box[3] - box[1])
+    return intersect_area / np.maximum(np.minimum(area, box_area), 1e-9)
+
+
+def fuse_boxes(boxes, scores, classes, groups=None, ios_threshold=0.6):
+    '''Fuse the pieces of objects split across tiles into their enclosing box
+
+    Starting from the highest scoring box, boxes of its class whose intersection with the
+    fused box covers more than ios_threshold of the smaller one are added to it, until none
+    is left. The fused box keeps the best score. Boxes of one group (tile) already went
+    through NMS, so a group contributes at most one box to each fused box.
+
+    Parameters
+    ----------
+    boxes: array, shape=(n, 4), y_min, x_min, y_max, x_max
+    scores: array, shape=(n,)
+    classes: array, shape=(n,)
+    groups: array, shape=(n,), optional, e.g. the tile index of every box
+
+    Returns
+    -------
+    boxes, scores, classes of the fused boxes, by descending score
+
+    '''
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    boxes = np.asarray(boxes, dtype='float32')[order]
+    scores, classes = np.asarray(scores)[order], np.asarray(classes)[order]
+    if groups is not None:
+        groups = np.asarray(groups)[order]
+
+    assigned = np.zeros(len(boxes), dtype=bool)
+    keep, fused = [], []
+    for i in range(len(boxes)):
+        if assigned[i]:
+            continue
+        assigned[i] = True
+        box = boxes[i].copy()
+        used_groups = [groups[i]] if groups is not None else []
+        while True:
+            candidates = ~assigned & (classes == classes[i])
+            if groups is not None:
+                candidates &= ~np.isin(groups, used_groups)
+            members = np.flatnonzero(candidates)
+            members = members[box_ios(box, boxes[members]) > ios_threshold]
+            if len(members) == 0:
+                break
+            if groups is not None:
+                # The best box of every group.
+                _, first = np.unique(groups[members], return_index=True)
+                members = members[first]
+                used_groups.extend(groups[members])
+            assigned[members] = True
+            box[:2] = np.minimum(box[:2], boxes[members, :2].min(axis=0))
+            box[2:] = np.maximum(box[2:], boxes[members, 2:].max(axis=0))
+        keep.append(i)
+        fused.append(box)
+    return np.array(fused, dtype='float32').reshape(-1, 4), scores[keep], classes[keep]
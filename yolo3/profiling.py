@@ -0,0 +1,210 @@
+"""Per-stage latency histograms and sampled TensorFlow traces of the detection pipeline."""
+
+import atexit
+import json
+import os
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from timeit import default_timer as timer
+
+import numpy as np
+
+
+class Histogram(object):
+    '''Durations in log spaced buckets: constant memory, percentiles within growth of the true value
+
+    Durations from lowest to highest seconds are bucketed, the few outside still count.
+    '''
+
+    def __init__(self, lowest=1e-5, highest=100., growth=1.05):
+        num_edges = int(np.ceil(np.log(highest / lowest) / np.log(growth))) + 1
+        self.edges = lowest * growth ** np.arange(num_edges)
+        self.counts = np.zeros(num_edges + 1, dtype='int64')
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, seconds):
+        self.counts[np.searchsorted(self.edges, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        '''Upper edge of the bucket holding the q-th percentile, in seconds'''
+        if not self.count:
+            return 0.
+        rank = max(1, int(np.ceil(q / 100. * self.count)))
+        i = np.searchsorted(np.cumsum(self.counts), rank)
+        return min(self.edges[i], self.max) if i < len(self.edges) else self.max
+
+    def summary(self, percentiles=(50, 95, 99)):
+        summary = {'count': self.count, 'mean_ms': 1e3 * self.total / max(self.count, 1), 'max_ms': 1e3 * self.max}
+        for q in percentiles:
+            summary['p{}_ms'.format(q)] = 1e3 * float(self.percentile(q))
+        return summary
+
+
+class LatencyRegistry(object):
+    '''One Histogram per stage name, safe to record into from several threads
+
+        with registry.time('letterbox'):
+            ...
+        registry.summary()['letterbox']['p95_ms']
+    '''
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            self.histograms[stage].add(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        start = timer()
+        try:
+            yield
+        finally:
+            self.record(stage, timer() - start)
+
+    def summary(self, percentiles=(50, 95, 99)):
+        '''{stage: {count, mean_ms, max_ms, p50_ms, ...}}'''
+        with self._lock:
+            return {stage: histogram.summary(percentiles) for stage, histogram in self.histograms.items()}
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+
+    def format(self):
+        '''Summary table, one line per stage'''
+        lines = ['{:>16} {:>8} {:>9} {:>9} {:>9} {:>9}'.format('stage', 'count', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms')]
+        for stage, s in sorted(self.summary().items()):
+            lines.append('{:>16} {:>8} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+                stage, s['count'], s['mean_ms'], s['p50_ms'], s['p95_ms'], s['p99_ms']))
+        return '\n'.join(lines)
+
+
+# Process wide registry, YOLO records into it unless given another one.
+latency = LatencyRegistry()
+
+
+def dump_at_exit(path, registry=latency):
+    '''Write the registry summary as JSON to path when the process exits'''
+    atexit.register(registry.dump, path)
+
+
+class TraceSampler(object):
+    '''Trace a sample of the sess.run calls of each call site with FULL_TRACE
+
+    Every sampled call writes out_dir/<name>_<call>.trace.json, a Chrome trace timeline
+    (chrome://tracing). The device time of every node is added up per op type and per layer
+    scope over all samples, out_dir/op_summary.txt ranks them after each sample.
+    every: trace one call in every, counted per name
+    warmup: first calls of each name that are never traced (graph setup, allocator growth)
+    max_samples: per name, tracing stops after that
+    '''
+
+    def __init__(self, out_dir, every=100, warmup=5, max_samples=20):
+        self.out_dir = out_dir
+        self.every = every
+        self.warmup = warmup
+        self.max_samples = max_samples
+        self.calls = Counter()
+        self.samples = Counter()
+        self.micros = {'op': Counter(), 'layer': Counter()}  # (name, op type or layer) -> microseconds
+        self._lock = threading.Lock()
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+
+    def _sample(self, name):
+        '''Count a call of name, returns its call index if it is to be traced, else None'''
+        with self._lock:
+            call = self.calls[name]
+            self.calls[name] += 1
+            if call < self.warmup or (call - self.warmup) % self.every or self.samples[name] >= self.max_samples:
+                return None
+            self.samples[name] += 1
+            return call
+
+    def run(self, sess, fetches, feed_dict, name):
+        '''sess.run, traced when this call of name is sampled'''
+        call = self._sample(name)
+        if call is None:
+            return sess.run(fetches, feed_dict=feed_dict)
+        return self._traced_run(sess, fetches, feed_dict, name, call)
+
+    def predict(self, model, x, name='classifier'):
+        '''model.predict of a keras model, traced when this call of name is sampled'''
+        call = self._sample(name) if hasattr(model, 'inputs') else None
+        if call is None:
+            return model.predict(x)
+        from keras import backend as K
+        feed_dict = {model.inputs[0]: x}
+        if not isinstance(K.learning_phase(), int):
+            feed_dict[K.learning_phase()] = 0
+        return self._traced_run(K.get_session(), model.outputs[0], feed_dict, name, call)
+
+    def _traced_run(self, sess, fetches, feed_dict, name, call):
+        import tensorflow as tf
+        from tensorflow.python.client import timeline
+        run_metadata = tf.RunMetadata()
+        result = sess.run(fetches, feed_dict=feed_dict, run_metadata=run_metadata,
+                          options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE))
+        path = os.path.join(self.out_dir, '{}_{}.trace.json'.format(name, call))
+        with open(path, 'w') as f:
+            f.write(timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format())
+        with self._lock:
+            for dev_stats in run_metadata.step_stats.dev_stats:
+                # GPU kernels are reported again per stream, only count the merged stream.
+                if '/stream:' in dev_stats.device and not dev_stats.device.endswith('/stream:all'):
+                    continue
+                for node_stats in dev_stats.node_stats:
+                    micros = node_stats.all_end_rel_micros
+                    self.micros['op'][(name, _op_type(node_stats))] += micros
+                    self.micros['layer'][(name, _layer_scope(node_stats.node_name))] += micros
+        self.write_summary()
+        return result
+
+    def format(self, by='op', top=25):
+        '''Ranked table of the traced device time per op type (by='op') or layer scope (by='layer')'''
+        lines = []
+        with self._lock:
+            micros = dict(self.micros[by])
+            samples = dict(self.samples)
+        for name in sorted(samples):
+            rows = sorted(((key, t) for (n, key), t in micros.items() if n == name), key=lambda row: -row[1])
+            total = float(sum(t for _, t in rows)) or 1.
+            lines.append('{}: {} traced calls, by {}'.format(name, samples[name], by))
+            lines.append('{:>40} {:>10} {:>7}'.format(by, 'ms/call', 'share'))
+            for key, t in rows[:top]:
+                lines.append('{:>40} {:>10.3f} {:>7.1%}'.format(key[-40:], t / 1e3 / samples[name], t / total))
+        return '\n'.join(lines)
+
+    def write_summary(self):
+        with open(os.path.join(self.out_dir, 'op_summary.txt'), 'w') as f:
+            f.write(self.format('op') + '\n\n' + self.format('layer') + '\n')
+
+
+def _op_type(node_stats):
+    # timeline_label is "node_name = OpType(inputs)"
+    label = node_stats.timeline_label
+    if ' = ' in label:
+        return label.split(' = ', 1)[1].split('(', 1)[0]
+    return node_stats.node_name
+
+
+def _layer_scope(node_name):
+    '''Keras layer (e.g. conv2d_12, leaky_re_lu_3) or top name scope (e.g. non_max_suppression) of a node'''
+    parts = [part for part in node_name.split('/') if not re.match(r'model(_\d+)?$', part)]
+    return parts[0] if parts else node_name
@@ -0,0 +1,50 @@
+"""TensorFlow session threading and CPU affinity of a process."""
+
+import os
+
+import tensorflow as tf
+from keras import backend as K
+
+_configured = None  # (intra, inter, cpus) of the session set by configure_session
+
+
+def configure_session(intra_op_threads=None, inter_op_threads=None, cpu_affinity=None):
+    '''Pin the process to cpu_affinity and give keras a session with these thread pools
+
+    None keeps the tensorflow default (one thread per core). Call before any model is loaded:
+    the keras session is replaced, models loaded in the previous one would lose their weights.
+    Calling again with the same settings is a no-op, so the YOLO and classifier loaders can
+    both take them. Returns the keras session.
+    '''
+    global _configured
+    cpus = tuple(sorted(cpu_affinity)) if cpu_affinity is not None else None
+    settings = (intra_op_threads, inter_op_threads, cpus)
+    if settings == (None, None, None) or settings == _configured:
+        return K.get_session()
+    assert _configured is None, \
+        'session already configured with {}, cannot switch to {} in the same process'.format(_configured, settings)
+    if cpus is not None:
+        assert hasattr(os, 'sched_setaffinity'), 'cpu_affinity needs os.sched_setaffinity (Linux)'
+        # Thread pools created from now on inherit the mask.
+        os.sched_setaffinity(0, cpus)
+    config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads or 0,
+                            inter_op_parallelism_threads=inter_op_threads or 0)
+    K.set_session(tf.Session(config=config))
+    _configured = settings
+    return K.get_session()
+
+
+def parse_cpus(text):
+    '''Parse a cpu list like "0-3,8,10-11" into [0, 1, 2, 3, 8, 10, 11]'''
+    cpus = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def available_cpus():
+    '''CPUs this process may run on'''
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
@@ -0,0 +1,70 @@
+"""Lazy sources of image names: directory scans, glob filters, manifests and shards."""
+
+import fnmatch
+import os
+import zlib
+
+IMAGE_PATTERNS = ('*.jpg', '*.jpeg')
+
+
+class ImageSource(object):
+    '''Iterable of image names relative to root, streamed without listing everything first
+
+    root: image directory
+    patterns: fnmatch patterns on the file name, case insensitive
+    recursive: also scan sub directories, names are then relative paths
+    manifest: file with one image name (relative to root) per line, read instead of scanning root
+    shard: (i, n), keep the names whose crc32 is i modulo n. The split does not depend on
+        the scan order, so a shard holds the same images on every run.
+    '''
+
+    def __init__(self, root, patterns=IMAGE_PATTERNS, recursive=False, manifest=None, shard=None):
+        self.root = root
+        self.patterns = [p.lower() for p in patterns]
+        self.recursive = recursive
+        self.manifest = manifest
+        self.shard = shard
+
+    def __iter__(self):
+        names = self._read_manifest() if self.manifest else self._scan('')
+        for name in names:
+            if self.shard is None or zlib.crc32(name.encode('utf-8')) % self.shard[1] == self.shard[0]:
+                yield name
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def subshard(self, k, m):
+        '''Source of the k-th of m shards of this source'''
+        i, n = self.shard or (0, 1)
+        return ImageSource(self.root, self.patterns, self.recursive, self.manifest, (i + n*k, n*m))
+
+    def _match(self, name):
+        name = name.lower()
+        return any(fnmatch.fnmatchcase(name, p) for p in self.patterns)
+
+    def _scan(self, prefix):
+        subdirs = []
+        for entry in os.scandir(os.path.join(self.root, prefix)):
+            if entry.is_dir():
+                if self.recursive:
+                    subdirs.append(os.path.join(prefix, entry.name))
+            elif self._match(entry.name):
+                yield os.path.join(prefix, entry.name)
+        for subdir in subdirs:
+            for name in self._scan(subdir):
+                yield name
+
+    def _read_manifest(self):
+        with open(self.manifest) as f:
+            for line in f:
+                name = line.strip()
+                if name:
+                    yield name
+
+
+def parse_shard(text):
+    '''Parse "i/n" into (i, n)'''
+    i, n = (int(x) for x in text.split('/'))
+    assert 0 <= i < n, 'shard must be i/n with 0 <= i < n, got {}'.format(text)
+    return i, n
@@ -0,0 +1,96 @@
+"""TensorFlow Lite inference backend, with post-training int8 quantization."""
+
+import numpy as np
+import tensorflow as tf
+from keras import backend as K
+
+
+def convert_keras(model, input_shape, representative_data, output_path):
+    '''Convert a keras model to TFLite with int8 weights and activations
+
+    input_shape: static (h, w, c) the model is converted for
+    representative_data: callable returning an iterable of float32 input batches of shape
+        (1, h, w, c), used to calibrate the activation ranges
+    Inputs and outputs stay float, TFLiteModel takes care of both cases anyway.
+    Call K.set_learning_phase(0) before building the model.
+    '''
+    inputs = K.placeholder(shape=(1, ) + tuple(input_shape))
+    outputs = model(inputs)
+    if not isinstance(outputs, list):
+        outputs = [outputs]
+    converter = tf.lite.TFLiteConverter.from_session(K.get_session(), [inputs], outputs)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    # The TF1 converter reads representative_dataset.input_gen, a plain callable is not enough.
+    converter.representative_dataset = tf.lite.RepresentativeDataset(lambda: ([x] for x in representative_data()))
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    flatbuffer = converter.convert()
+    with open(output_path, 'wb') as f:
+        f.write(flatbuffer)
+    print('{} written, {:.1f} MB'.format(output_path, len(flatbuffer) / 2.**20))
+
+
+class TFLiteModel(object):
+    '''tf.lite.Interpreter with the predict of a keras model, so it can replace one'''
+
+    def __init__(self, model_path):
+        self.interpreter = tf.lite.Interpreter(model_path=model_path)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()
+        self.input_shape = tuple(self.input_details['shape'][1:])
+
+    def run(self, x):
+        '''Run one (1, h, w, c) float batch, returns the list of float outputs'''
+        self.interpreter.set_tensor(self.input_details['index'], _quantize(x, self.input_details))
+        self.interpreter.invoke()
+        return [_dequantize(self.interpreter.get_tensor(details['index']), details)
+                for details in self.output_details]
+
+    def predict(self, x):
+        '''keras Model.predict, one interpreter call per sample'''
+        outputs = [self.run(x[i:i + 1]) for i in range(len(x))]
+        outputs = [np.concatenate(output) for output in zip(*outputs)]
+        return outputs[0] if len(outputs) == 1 else outputs
+
+
+def _quantize(x, details):
+    if details['dtype'] in (np.int8, np.uint8):
+        scale, zero_point = details['quantization']
+        info = np.iinfo(details['dtype'])
+        return np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(details['dtype'])
+    return np.asarray(x, dtype=details['dtype'])
+
+
+def _dequantize(x, details):
+    if details['dtype'] in (np.int8, np.uint8):
+        scale, zero_point = details['quantization']
+        return (x.astype('float32') - zero_point) * scale
+    return x
+
+
+def _sigmoid(x):
+    return 1. / (1. + np.exp(-x))
+
+
+def yolo_decode_np(yolo_outputs, anchors, num_classes, input_shape):
+    '''Numpy yolo3.model.yolo_decode of one image, boxes in pixels of the (h, w) input_shape
+
+    yolo_outputs: list of raw (1, grid_h, grid_w, num_anchors*(num_classes+5)) outputs
+    Returns boxes (y_min, x_min, y_max, x_max) and box_scores, one row per anchor and cell.
+    '''
+    num_layers = len(yolo_outputs)
+    anchor_mask = [[6,7,8], [3,4,5], [0,1,2]] if num_layers==3 else [[3,4,5], [1,2,3]] # default setting
+    h, w = input_shape
+    boxes, box_scores = [], []
+    for l, feats in enumerate(yolo_outputs):
+        grid_h, grid_w = feats.shape[1:3]
+        feats = feats.reshape(grid_h, grid_w, len(anchor_mask[l]), num_classes + 5)
+        grid_y, grid_x = np.meshgrid(np.arange(grid_h), np.arange(grid_w), indexing='ij')
+        grid = np.stack([grid_x, grid_y], axis=-1)[:, :, None, :]
+
+        box_xy = (_sigmoid(feats[..., :2]) + grid) / [grid_w, grid_h] * [w, h]
+        box_wh = np.exp(feats[..., 2:4]) * anchors[anchor_mask[l]]
+        box_yx, box_hw = box_xy[..., ::-1], box_wh[..., ::-1]
+        boxes.append(np.concatenate([box_yx - box_hw / 2., box_yx + box_hw / 2.], axis=-1).reshape(-1, 4))
+        box_scores.append((_sigmoid(feats[..., 4:5]) * _sigmoid(feats[..., 5:])).reshape(-1, num_classes))
+    return np.concatenate(boxes).astype('float32'), np.concatenate(box_scores).astype('float32')
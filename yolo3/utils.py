@@ -1,11 +1,17 @@
 """Miscellaneous utility functions."""
 
+from collections import namedtuple
 from functools import reduce
 
 from PIL import Image
 import numpy as np
 from matplotlib.colors import rgb_to_hsv, hsv_to_rgb
 
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
 def compose(*funcs):
     """Compose arbitrarily many functions, evaluated left to right.
 
@@ -30,6 +36,137 @@ def letterbox_image(image, size):
     new_image.paste(image, ((w-nw)//2, (h-nh)//2))
     return new_image
 
+# Where the image landed in a letterboxed array: letterboxed = original * scale + offset.
+LetterboxMeta = namedtuple('LetterboxMeta', ['scale_x', 'scale_y', 'dx', 'dy'])
+
+
+class Letterboxer(object):
+    '''Letterbox images into a preallocated, reused uint8 array
+
+    size: (w, h) of the letterboxed image
+    resample: 'nearest', 'bilinear', 'bicubic', 'area' or 'lanczos'
+    backend: 'pil' (default) or 'cv2'. The models are trained on PIL bicubic resizes, which
+        antialias when shrinking. cv2 filters do not, so cv2 shrinks with INTER_AREA and only
+        uses resample to enlarge; compare F1 before switching a deployment to it.
+    '''
+    pil_filters = {'nearest': Image.NEAREST, 'bilinear': Image.BILINEAR, 'bicubic': Image.BICUBIC,
+                   'area': Image.BOX, 'lanczos': Image.LANCZOS}
+    cv2_filters = {} if cv2 is None else {
+        'nearest': cv2.INTER_NEAREST, 'bilinear': cv2.INTER_LINEAR, 'bicubic': cv2.INTER_CUBIC,
+        'area': cv2.INTER_AREA, 'lanczos': cv2.INTER_LANCZOS4}
+
+    def __init__(self, size, resample='bicubic', backend=None, fill=128):
+        self.size = size
+        self.resample = resample
+        self.backend = backend or 'pil'
+        assert self.backend in ('cv2', 'pil'), 'Unknown letterbox backend: {}'.format(self.backend)
+        assert self.backend != 'cv2' or cv2 is not None, 'opencv is not installed'
+        self.fill = fill
+        w, h = size
+        self.buffer = np.full((h, w, 3), fill, dtype='uint8')
+
+    def __call__(self, image, out=None):
+        '''Letterbox a PIL image into out, returns (out, LetterboxMeta)
+
+        out defaults to the internal buffer, which the next call overwrites.
+        '''
+        if out is None:
+            out = self.buffer
+        iw, ih = image.size
+        w, h = self.size
+        scale = min(w/iw, h/ih)
+        nw = int(iw*scale)
+        nh = int(ih*scale)
+        dx = (w-nw)//2
+        dy = (h-nh)//2
+
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        if self.backend == 'cv2':
+            interpolation = cv2.INTER_AREA if scale < 1 else self.cv2_filters[self.resample]
+            resized = cv2.resize(np.asarray(image), (nw, nh), interpolation=interpolation)
+        else:
+            resized = np.asarray(image.resize((nw, nh), self.pil_filters[self.resample]))
+
+        # Only the bars around the image need the fill value.
+        out[:dy] = self.fill
+        out[dy+nh:] = self.fill
+        out[dy:dy+nh, :dx] = self.fill
+        out[dy:dy+nh, dx+nw:] = self.fill
+        out[dy:dy+nh, dx:dx+nw] = resized
+        return out, LetterboxMeta(nw/iw, nh/ih, dx, dy)
+
+
+def correct_boxes(boxes, meta):
+    '''Map boxes (y_min, x_min, y_max, x_max) from letterboxed to original image pixels'''
+    offset = np.array([meta.dy, meta.dx, meta.dy, meta.dx], dtype='float32')
+    scale = np.array([meta.scale_y, meta.scale_x, meta.scale_y, meta.scale_x], dtype='float32')
+    return (np.asarray(boxes, dtype='float32') - offset) / scale
+
+
+def shape_buckets(model_image_size, aspect_ratios=(4/3., 1., 3/4.)):
+    '''Rectangular (h, w) input shapes, multiples of 32, for images of aspect_ratios (w / h)
+
+    Each shape fits in model_image_size (h, w) and follows its aspect ratio up to the 32 pixel
+    rounding, e.g. (320, 416) for 4:3 landscape photos instead of a square (416, 416).
+    '''
+    h, w = model_image_size
+    buckets = []
+    for ratio in aspect_ratios:
+        if ratio >= w / h:
+            shape = (max(32, int(round(w / ratio / 32.)) * 32), w)
+        else:
+            shape = (h, max(32, int(round(h * ratio / 32.)) * 32))
+        if shape not in buckets:
+            buckets.append(shape)
+    return buckets
+
+
+def tile_grid(image_size, tile_size, overlap=0.25, max_tiles=None):
+    '''Return overlapping tiles (left, top, right, bottom) covering an image
+
+    image_size, tile_size: (w, h). The tile size grows (aspect kept) until at most
+    max_tiles tiles cover the image, neighbours overlap by at least overlap of a tile.
+    '''
+    w, h = image_size
+    tw, th = tile_size
+    while True:
+        tw_, th_ = min(int(tw), w), min(int(th), h)
+        xs = _tile_starts(w, tw_, overlap)
+        ys = _tile_starts(h, th_, overlap)
+        if max_tiles is None or len(xs)*len(ys) <= max_tiles:
+            return [(x, y, x+tw_, y+th_) for y in ys for x in xs]
+        tw, th = tw*1.25, th*1.25
+
+
+def _tile_starts(length, tile, overlap):
+    if tile >= length:
+        return [0]
+    n = int(np.ceil((length - tile) / (tile * (1. - overlap)))) + 1
+    return np.linspace(0, length - tile, n).round().astype('int').tolist()
+
+
+def open_image(path, draft_size=None):
+    '''Open an image, decoding JPEGs at a reduced resolution when draft_size is given
+
+    draft_size: (w, h), JPEG DCT scaling picks the largest 1/2, 1/4 or 1/8 reduction
+        that is still at least this size. Other formats are decoded as is.
+    Returns the image and its original (w, h), see scale_boxes.
+    '''
+    image = Image.open(path)
+    original_size = image.size
+    if draft_size is not None:
+        image.draft('RGB', tuple(draft_size))
+    return image, original_size
+
+
+def scale_boxes(boxes, size, original_size):
+    '''Rescale boxes (y_min, x_min, y_max, x_max) from an image of size (w, h) to original_size'''
+    sx = original_size[0] / size[0]
+    sy = original_size[1] / size[1]
+    return np.asarray(boxes, dtype='float32') * np.array([sy, sx, sy, sx], dtype='float32')
+
+
 def rand(a=0, b=1):
     return np.random.rand()*(b-a) + a
 
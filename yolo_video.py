@@ -1,95 +1,427 @@
 from yolo import YOLO
 from PIL import Image
 import os
+import multiprocessing
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice, repeat
+from queue import Queue, Empty, Full
+from threading import Thread
 from matplotlib import pyplot
 import numpy as np
 from classification_train import predict_class
 import logging
 from classification_train import get_resnet50
+from yolo3.annotations import classes_remap, format_detections, read_completed, AnnotationWriter
+from yolo3.cache import PredictionCacheWriter
+from yolo3.cascade import CascadePolicy
+from yolo3.sources import ImageSource, IMAGE_PATTERNS, parse_shard
+from yolo3.profiling import latency, dump_at_exit, TraceSampler
+from yolo3.session import configure_session, parse_cpus, available_cpus
+from yolo3.utils import open_image, shape_buckets
 
 
-classes_remap = {
-    0: 1, # Green
-    1: 2, # Yellow
-    2: 3, # White
-    3: 4, # Silver/Grey
-    4: 5, # Blue
-    5: 6, # Red
-}
+def draft_size(yolo):
+    '''JPEG decode size for yolo, None (full resolution) when its input size is not fixed'''
+    if yolo.model_image_size == (None, None):
+        return None
+    # The largest input the image may be letterboxed to.
+    sizes = [yolo.model_image_size] + [stage[2] for stage in yolo.cascade_stages if stage[2] is not None]
+    return max(w for _, w in sizes), max(h for h, _ in sizes)
 
 
-def detect_img(yolo, imgs_path, outf, cls=None, remap=False, visualize=False):
-    with open(outf, 'w') as of:
-        for imgname in os.listdir(imgs_path):
-            if imgname.lower().endswith('.jpg') or imgname.lower().endswith('.jpeg'):
-                logging.debug('Input image filename:{}'.format(imgname))
-                image = Image.open(os.path.join(imgs_path, imgname))
-                r_image, boxes, scores, classes = yolo.detect_image(image, predict_class, cls, visualize=visualize)
-                """
-                # Classify this bounding box
-                if cls:
-                    # boxes is a list of [top, left, bottom, right] i.e [y1, x1, y2, x2]
-                    y = predict_class(image, boxes, cls)
-                    print('y = {}'.format(y))
-                """
-
-                if len(boxes) == 0:
-                    continue
-
-                # Output format
-                # PIC.JPG:[xmin1,ymin1,width1,height1,color1],..,[xminN,yminN,widthN,heightN,colorN]
-                output_line = "{}:".format(imgname)
-                for i, b in enumerate(boxes):
-                    y1, x1, y2, x2 = b
-                    predicted_class = classes[i]
-                    if remap:
-                        predicted_class = classes_remap[int(predicted_class)]
-
-                    y1 = max(0, np.floor(y1 + 0.5).astype('int32'))
-                    x1 = max(0, np.floor(x1 + 0.5).astype('int32'))
-                    y2 = min(image.size[1], np.floor(y2 + 0.5).astype('int32'))
-                    x2 = min(image.size[0], np.floor(x2 + 0.5).astype('int32'))
-
-                    output_line += "[{},{},{},{},{}]".format(x1, y1, x2 - x1, y2 - y1, predicted_class)
-                    if i < (len(boxes) - 1):
-                        output_line += ','
-                    else:
-                        output_line += '\n'
-
-                of.write(output_line)
+def decode_images(imgs_path, imgnames, size=None, workers=2, depth=8, registry=latency):
+    '''Yield (imgname, image, original_size) in order, decoding up to depth images ahead on worker threads
+
+    registry: yolo3.profiling.LatencyRegistry the decode durations are recorded in
+    '''
+    def decode(imgname):
+        logging.debug('Input image filename:{}'.format(imgname))
+        with registry.time('decode'):
+            image, original_size = open_image(os.path.join(imgs_path, imgname), size)
+            image.load()  # PIL decodes lazily, make it happen on the worker
+        return imgname, image, original_size
+
+    imgnames = iter(imgnames)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque(pool.submit(decode, imgname) for imgname in islice(imgnames, depth))
+        while pending:
+            decoded = pending.popleft().result()
+            for imgname in islice(imgnames, 1):
+                pending.append(pool.submit(decode, imgname))
+            yield decoded
+
+
+def write_detections(writer, detections, remap, progress=None, errors=None):
+    '''Writer stage of detect_img: consume (imgname, boxes, classes, original_size) until None
+
+    writer: yolo3.annotations.AnnotationWriter
+    progress: optional callable, called with the number of completed images
+    errors: list the exception that stops the writer is appended to, for the thread that waits on it
+    '''
+    count = 0
+    try:
+        while True:
+            item = detections.get()
+            if item is None:
+                break
+            imgname, boxes, classes, original_size = item
+            # Output format
+            # PIC.JPG:[xmin1,ymin1,width1,height1,color1],..,[xminN,yminN,widthN,heightN,colorN]
+            output_line = format_detections(imgname, boxes, classes, original_size, remap)
+            if output_line is not None:
                 logging.debug(output_line)
+            writer.add(imgname, output_line)
+            count += 1
+            if progress is not None:
+                progress(count)
+    except Exception as e:
+        if errors is None:
+            raise
+        errors.append(e)
+
+
+def _put_detection(detections, item, writer):
+    '''detections.put that gives up once the writer thread is gone, instead of blocking forever'''
+    while writer.is_alive():
+        try:
+            detections.put(item, timeout=1.)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def detect_img(yolo, imgs_path, outf, cls=None, remap=False, visualize=False, batch_size=1, score=None, iou=None,
+               close_session=True, draft=False, decode_workers=2, queue_depth=8, imgnames=None, resume=False,
+               flush_every=32, progress=None, tiled=False):
+    '''Detect on every jpg of imgs_path (or on imgnames) and write the annotation lines to outf
+
+    imgnames: iterable of names relative to imgs_path, e.g. a yolo3.sources.ImageSource. It is
+        consumed lazily, the first images are detected while the rest is still being listed.
 
-                if r_image:
+    Decoding (decode_workers threads), inference (this thread) and writing (one thread) run
+    as a pipeline. At most queue_depth images wait between two stages, a slow stage blocks
+    the one feeding it instead of buffering the whole directory.
+    draft: decode JPEGs near the model input size, boxes are still reported in original pixels.
+        Off by default, the lower quality decode may change the detections.
+    resume: append to outf, skipping the images it (or its outf + '.done' manifest) already completed.
+        outf is written flush_every images at a time, see yolo3.annotations.AnnotationWriter.
+    progress: callable, called by the writer with the number of images completed by this call
+    tiled: YOLO.detect_image_tiled on the full resolution image, one image at a time (no draft)
+    '''
+    size = draft_size(yolo) if draft and not tiled else None
+    if imgnames is None:
+        imgnames = ImageSource(imgs_path)
+
+    annotations = AnnotationWriter(outf, resume, flush_every)
+    if annotations.completed:
+        print('resuming {}: skipping {} completed images'.format(outf, len(annotations.completed)))
+        completed = frozenset(annotations.completed)
+        imgnames = (imgname for imgname in imgnames if imgname not in completed)
+    detections = Queue(maxsize=queue_depth)
+    writer_errors = []
+    writer = Thread(target=write_detections, args=(annotations, detections, remap, progress, writer_errors))
+    writer.start()
+    try:
+        decoded = decode_images(imgs_path, imgnames, size, decode_workers, queue_depth, yolo.latency)
+        while writer.is_alive():
+            batch = list(islice(decoded, batch_size))
+            if not batch:
+                break
+            batch_names, images, original_sizes = zip(*batch)
+            stages = repeat(None)
+            if tiled:
+                results = [yolo.detect_image_tiled(image, predict_class, cls, visualize=visualize, score=score, iou=iou)
+                           for image in images]
+            elif batch_size > 1 and not yolo.cascade_stages:
+                results = yolo.detect_images(images, batch_size=batch_size, classification_cb=predict_class,
+                                             classification_cb_args=cls, visualize=visualize, score=score, iou=iou,
+                                             original_sizes=original_sizes)
+            else:
+                # One image per sess.run, the cascade settles each image at its own stage.
+                results, stages = [], []
+                for image, original_size in zip(images, original_sizes):
+                    results.append(yolo.detect_image(image, predict_class, cls, visualize=visualize, score=score,
+                                                     iou=iou, original_size=original_size))
+                    stages.append(yolo.last_stage)
+
+            for imgname, original_size, (r_image, boxes, scores, classes), stage in zip(
+                    batch_names, original_sizes, results, stages):
+                if stage is not None:
+                    logging.debug('{}: cascade ended at {}'.format(imgname, stage))
+                if not _put_detection(detections, (imgname, boxes, classes, original_size), writer):
+                    break
+                if r_image and len(boxes):
                     # visualization is done by obtaining the image that was drawn in the yolo detection, without class remap - so for each class
                     # needs to add +1 to get actual class
                     pyplot.figure()
                     pyplot.imshow(np.asarray(r_image))
                     pyplot.show()
+    finally:
+        _put_detection(detections, None, writer)
+        writer.join()
+        annotations.close()
+    if writer_errors:
+        # Images after the failure were not written, a resumed run picks them up.
+        raise RuntimeError('writing {} failed'.format(outf)) from writer_errors[0]
+
+    if yolo.cascade_stages:
+        print(yolo.cascade_stats.summary())
+    logging.debug('stage latencies:\n' + yolo.latency.format())
+    if close_session:
+        # close_session=False keeps the model loaded, e.g. to sweep score / iou.
+        yolo.close_session()
 
+
+def cache_predictions(yolo, imgs_path, cache_path, draft=False, imgnames=None):
+    '''Write decoded, pre-NMS predictions of every image to cache_path, see replay_predictions.py'''
+    size = draft_size(yolo) if draft else None
+    if imgnames is None:
+        imgnames = ImageSource(imgs_path)
+    with PredictionCacheWriter(cache_path, len(yolo.class_names)) as writer:
+        for imgname in imgnames:
+            logging.debug('Input image filename:{}'.format(imgname))
+            image, original_size = open_image(os.path.join(imgs_path, imgname), size)
+            boxes, box_scores = yolo.predict_raw(image, original_size)
+            writer.add(imgname, original_size, boxes, box_scores)
     yolo.close_session()
 
 
+def load_classifier(weights='resnet50_best.h5', intra_op_threads=None, inter_op_threads=None, cpu_affinity=None):
+    '''resnet50 post classifier, a .tflite file from convert_tflite.py loads on the TFLite interpreter
+
+    intra_op_threads, inter_op_threads, cpu_affinity: see yolo3.session.configure_session,
+        pass the same to YOLO when the classifier is loaded first
+    '''
+    logging.debug("loading classifier : resnet50")
+    configure_session(intra_op_threads, inter_op_threads, cpu_affinity)
+    if weights.endswith('.tflite'):
+        from yolo3.tflite import TFLiteModel
+        return TFLiteModel(weights)
+    resnet50 = get_resnet50(num_classes=6, w=None)
+    resnet50.load_weights(weights)
+    return resnet50
+
+
+def _shard_worker(shard, source, parts_dir, yolo_args, session_args, progress_queue,
+                  fused=False, batch_size=1, draft=False, tiled=False, classifier_weights='resnet50_best.h5',
+                  latency_json=None):
+    '''Process entry of detect_img_sharded: detect on source with a private YOLO and classifier
+
+    session_args: intra_op_threads, inter_op_threads and cpu_affinity of this worker
+    '''
+    part_path = os.path.join(parts_dir, 'part{}.txt'.format(shard))
+    done = len(read_completed(part_path))
+    progress_queue.put((shard, done))
+
+    resnet50 = load_classifier(classifier_weights, **session_args)
+    yolo = YOLO(**dict(yolo_args, **session_args))
+    if fused:
+        yolo.fuse_classifier(resnet50)
+    detect_img(yolo, source.root, part_path, cls={'resnet50': resnet50}, remap=True, batch_size=batch_size,
+               draft=draft, imgnames=source, resume=True, tiled=tiled,
+               progress=lambda count: progress_queue.put((shard, done + count)))
+    if latency_json:
+        # atexit does not run in multiprocessing children.
+        latency.dump('{}.shard{}'.format(latency_json, shard))
+
+
+def merge_parts(part_paths, outf):
+    '''Merge shard annotation files into outf, one line per image sorted by image name'''
+    lines = {}
+    for part_path in part_paths:
+        if not os.path.exists(part_path):
+            continue
+        with open(part_path) as f:
+            for line in f:
+                # A line written again after a resume replaces the first one.
+                lines[line.split(':', 1)[0]] = line
+    with open(outf, 'w') as of:
+        for imgname in sorted(lines):
+            of.write(lines[imgname])
+
+
+def detect_img_sharded(yolo_args, source, outf, workers, intra_op_threads=None, inter_op_threads=1, pin_cpus=False,
+                       report_every=100, **worker_args):
+    '''detect_img over workers processes, each with its own YOLO session, merged into outf
+
+    source: yolo3.sources.ImageSource, every worker scans its own subshard of it
+    intra_op_threads: per worker, default the available cores / workers
+    pin_cpus: give every worker its own slice of the available cores, so workers do not
+        oversubscribe each other
+    Shards write to outf + '.parts'. After a crash, rerunning the same command skips the images
+    that are already done. The parts directory is removed once outf is merged.
+    worker_args: fused, batch_size, draft, tiled, classifier_weights, latency_json of _shard_worker
+    '''
+    cpus = available_cpus()
+    if intra_op_threads is None:
+        intra_op_threads = max(1, len(cpus) // workers)
+    def session_args(shard):
+        if not pin_cpus:
+            cpu_affinity = None
+        elif workers <= len(cpus):
+            cpu_affinity = cpus[shard * len(cpus) // workers:(shard + 1) * len(cpus) // workers]
+        else:
+            cpu_affinity = [cpus[shard % len(cpus)]]
+        return {'intra_op_threads': intra_op_threads, 'inter_op_threads': inter_op_threads,
+                'cpu_affinity': cpu_affinity}
+    parts_dir = outf + '.parts'
+    if not os.path.exists(parts_dir):
+        os.makedirs(parts_dir)
+
+    # spawn: tensorflow state does not survive a fork.
+    ctx = multiprocessing.get_context('spawn')
+    progress_queue = ctx.Queue()
+    processes = [ctx.Process(target=_shard_worker,
+                             args=(shard, source.subshard(shard, workers), parts_dir, yolo_args,
+                                   session_args(shard), progress_queue),
+                             kwargs=worker_args)
+                 for shard in range(workers)]
+    for p in processes:
+        p.start()
+
+    # The shards are scanned lazily, so progress is a count of completed images, not a fraction.
+    counts, reported = {}, {}
+    while any(p.is_alive() for p in processes) or not progress_queue.empty():
+        try:
+            shard, count = progress_queue.get(timeout=1.)
+        except Empty:
+            continue
+        counts[shard] = count
+        if shard not in reported or count - reported[shard] >= report_every:
+            reported[shard] = count
+            print('shard {}/{}: {} images done'.format(shard, workers, count))
+    for p in processes:
+        p.join()
+    print('{} images done: {}'.format(sum(counts.values()), ', '.join(
+        'shard {} {}'.format(shard, count) for shard, count in sorted(counts.items()))))
+
+    failed = [shard for shard, p in enumerate(processes) if p.exitcode != 0]
+    if failed:
+        raise RuntimeError('shards {} failed, rerun to resume from {}'.format(failed, parts_dir))
+    merge_parts([os.path.join(parts_dir, 'part{}.txt'.format(shard)) for shard in range(workers)], outf)
+    shutil.rmtree(parts_dir)
+
+
 from optparse import OptionParser
 def main():
     parser = OptionParser()
     parser.add_option("-p", "--path", dest="path")
     parser.add_option("-o", "--out", dest="outf")
+    parser.add_option("-b", "--batch", dest="batch_size", help="images per sess.run", default=1, type=int)
+    parser.add_option("--size", dest="size", type=int,
+                      help="square model input size, a multiple of 32 (default 416, see autotune.py)")
+    parser.add_option("-f", "--fused", dest="fused", action="store_true", default=False,
+                      help="run the resnet50 post classifier inside the detection graph")
+    parser.add_option("--tflite", dest="tflite", help="detect with this .tflite model (convert_tflite.py) "
+                      "instead of the keras one")
+    parser.add_option("--classifier", dest="classifier", default='resnet50_best.h5',
+                      help="resnet50 post classifier weights, .h5 or .tflite")
+    parser.add_option("-c", "--cache", dest="cache", help="write pre-NMS predictions to this directory instead")
+    parser.add_option("--draft", dest="draft", action="store_true", default=False,
+                      help="decode JPEGs near the model input size instead of at full resolution, "
+                      "check the F1 with it before relying on it")
+    parser.add_option("-t", "--tiled", dest="tiled", action="store_true", default=False,
+                      help="detect on overlapping full resolution tiles, for small or distant buses")
+    parser.add_option("--buckets", dest="buckets", action="store_true", default=False,
+                      help="rectangular input shapes by image aspect ratio (4:3, 1:1, 3:4) instead of square")
+    parser.add_option("--cascade", dest="cascade", type="string",
+                      help="comma separated input sizes, e.g. 320,608: escalate uncertain images to the next size")
+    parser.add_option("--cascade_band", dest="cascade_band", type="string", default="0.3,0.6",
+                      help="low,high: escalate when the best score is in this band (or no box is found)")
+    parser.add_option("-g", "--gate", dest="gate", help="tiny YOLO weights run first, the full model only runs "
+                      "when the gate is uncertain (--cascade_band, --gate_max_count, --gate_min_size)")
+    parser.add_option("--gate_anchors", dest="gate_anchors", default=YOLO.get_defaults('gate_anchors_path'))
+    parser.add_option("--gate_max_count", dest="gate_max_count", type=int,
+                      help="escalate when the gate finds more boxes than this")
+    parser.add_option("--gate_min_size", dest="gate_min_size", type=float,
+                      help="escalate when a gate box side is below this fraction of the image")
+    parser.add_option("-r", "--resume", dest="resume", action="store_true", default=False,
+                      help="append to the output, skipping the images it already has")
+    parser.add_option("--recursive", dest="recursive", action="store_true", default=False,
+                      help="also detect on images in sub directories of the path")
+    parser.add_option("--glob", dest="patterns", action="append",
+                      help="file name pattern of the images, may repeat (default *.jpg and *.jpeg)")
+    parser.add_option("--manifest", dest="manifest", help="file listing the image names to detect on")
+    parser.add_option("--shard", dest="shard", type="string", help="i/n, only detect on the i-th of n shards")
+    parser.add_option("-w", "--workers", dest="workers", default=1, type=int,
+                      help="worker processes, each with its own model (resumable after a crash)")
+    parser.add_option("--latency_json", dest="latency_json",
+                      help="write per-stage latency percentiles (yolo3.profiling) to this JSON file at exit, "
+                      "one file per worker with a .shardN suffix")
+    parser.add_option("--trace", dest="trace", help="directory of Chrome trace timelines of sampled detector and "
+                      "classifier runs, with a per-op summary (op_summary.txt)")
+    parser.add_option("--trace_every", dest="trace_every", default=100, type=int,
+                      help="trace one run in every TRACE_EVERY, per call site")
+    parser.add_option("--threads", dest="threads", type=int,
+                      help="tensorflow intra-op threads per worker, default cores / workers")
+    parser.add_option("--inter_threads", dest="inter_threads", type=int,
+                      help="tensorflow inter-op threads per worker, default 1 with workers, else all cores")
+    parser.add_option("--affinity", dest="affinity", type="string",
+                      help="cpu list to run on, e.g. 0-7,16-23 (single worker)")
+    parser.add_option("--pin", dest="pin", action="store_true", default=False,
+                      help="pin every worker to its own slice of the available cores")
     (options, args) = parser.parse_args()
 
-    classificator = {}
-    logging.debug("loading classifier : resnet50")
-    resnet50 = get_resnet50(num_classes=6, w=None)
-    resnet50.load_weights('resnet50_best.h5')
-
-    classificator['resnet50'] = resnet50
-
+    if options.trace and options.workers > 1:
+        parser.error('--trace needs a single worker')
+    if options.latency_json and options.workers <= 1:
+        dump_at_exit(options.latency_json)
+    source = ImageSource(options.path, options.patterns or IMAGE_PATTERNS, options.recursive, options.manifest,
+                         parse_shard(options.shard) if options.shard else None)
     yolo_args = {
         'model_path': 'final_single_cust_loss4_anchs.h5',
         'anchors_path': 'bus_anchors.txt',
         'classes_path': 'bus_classes_single.txt',
     }
-    detect_img(YOLO(**yolo_args), imgs_path=options.path, outf=options.outf, cls=classificator, remap=True,
-               visualize=True)
+    if options.size:
+        yolo_args['model_image_size'] = (options.size, options.size)
+    if options.tflite:
+        yolo_args['model_path'] = options.tflite
+        yolo_args['backend'] = 'tflite'
+    if options.cascade:
+        yolo_args['cascade_sizes'] = [(int(size), int(size)) for size in options.cascade.split(',')]
+        yolo_args['cascade_policy'] = CascadePolicy(tuple(float(x) for x in options.cascade_band.split(',')))
+    if options.gate:
+        yolo_args['gate_model_path'] = options.gate
+        yolo_args['gate_anchors_path'] = options.gate_anchors
+        yolo_args['gate_policy'] = CascadePolicy(tuple(float(x) for x in options.cascade_band.split(',')),
+                                                 max_count=options.gate_max_count,
+                                                 min_box_size=options.gate_min_size)
+    if options.buckets:
+        yolo_args['shape_buckets'] = shape_buckets(yolo_args.get('model_image_size',
+                                                                 YOLO.get_defaults('model_image_size')))
+    if options.cache:
+        cache_predictions(YOLO(**yolo_args), imgs_path=options.path, cache_path=options.cache, draft=options.draft,
+                          imgnames=source)
+        return
+
+    if options.workers > 1:
+        detect_img_sharded(yolo_args, source, outf=options.outf, workers=options.workers,
+                           intra_op_threads=options.threads, inter_op_threads=options.inter_threads or 1,
+                           pin_cpus=options.pin, fused=options.fused, batch_size=options.batch_size,
+                           draft=options.draft, tiled=options.tiled, classifier_weights=options.classifier,
+                           latency_json=options.latency_json)
+        return
+
+    session_args = {'intra_op_threads': options.threads, 'inter_op_threads': options.inter_threads,
+                    'cpu_affinity': parse_cpus(options.affinity) if options.affinity else None}
+    yolo_args.update(session_args)
+    classificator = {}
+    resnet50 = load_classifier(options.classifier, **session_args)
+    classificator['resnet50'] = resnet50
+    if options.trace:
+        yolo_args['trace_sampler'] = classificator['trace_sampler'] = TraceSampler(options.trace,
+                                                                                   options.trace_every)
+
+    yolo = YOLO(**yolo_args)
+    if options.fused:
+        yolo.fuse_classifier(resnet50)
+    detect_img(yolo, imgs_path=options.path, outf=options.outf, cls=classificator, remap=True,
+               visualize=True, batch_size=options.batch_size, draft=options.draft, resume=options.resume,
+               imgnames=source, tiled=options.tiled)
 
 
 if __name__ == "__main__":